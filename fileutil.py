@@ -1,11 +1,33 @@
 #!/usr/bin/env python3
 
 import os
+import errno
 import stat
 import shutil
+import subprocess
 import tarfile
+import tempfile
 import zipfile
 import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import lru_cache
+
+# optional: parallel decompression of .tar.gz/.tar.bz2 archives
+try:
+    import rapidgzip
+except ImportError:
+    rapidgzip = None
+try:
+    import indexed_bzip2
+except ImportError:
+    indexed_bzip2 = None
+# not available on Windows
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 ###################################################
 ## chmod
@@ -24,74 +46,514 @@ def chmod_remove(file, stat):
 ## copy
 ###################################################
 
+COPY_BUFSIZE = 8 * 1024 * 1024
+# buffer for the userspace fallback copy
+READ_BUFSIZE = 1024 * 1024
+# files up to this size are copied with a single read/write
+SMALL_FILE_SIZE = 64 * 1024
+# Linux ioctl to share the data blocks of a file (btrfs, XFS, bcachefs, ...)
+FICLONE = 0x40049409
+# errors indicating that the in-kernel copy is not supported for these files
+_FAST_COPY_ERRNOS = {errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EPERM}
+
+class _GiveupOnFastCopy(Exception):
+    """Copy method not supported, try the next one."""
+
+def _ficlone(inFd, outFd):
+    """Copy-on-write clone of the whole file: no data is copied."""
+    if fcntl is None:
+        raise _GiveupOnFastCopy()
+    try:
+        fcntl.ioctl(outFd, FICLONE, inFd)
+    except OSError as e:
+        if e.errno in _FAST_COPY_ERRNOS or e.errno in (errno.ENOTTY, errno.EBADF):
+            raise _GiveupOnFastCopy()
+        raise
+
+def _copyFileRange(inFd, outFd):
+    """In-kernel copy (reflink/server-side copy on CoW filesystems and NFS)."""
+    try:
+        while os.copy_file_range(inFd, outFd, COPY_BUFSIZE) > 0:
+            pass
+    except AttributeError:
+        raise _GiveupOnFastCopy()
+    except OSError as e:
+        if e.errno in _FAST_COPY_ERRNOS:
+            raise _GiveupOnFastCopy()
+        raise
+
+def _sendfile(inFd, outFd):
+    try:
+        while os.sendfile(outFd, inFd, None, COPY_BUFSIZE) > 0:
+            pass
+    except AttributeError:
+        raise _GiveupOnFastCopy()
+    except OSError as e:
+        if e.errno in _FAST_COPY_ERRNOS:
+            raise _GiveupOnFastCopy()
+        raise
+
+def _readinto(fsrc, fdst):
+    """Userspace copy with a pre-allocated buffer."""
+    buf = bytearray(READ_BUFSIZE)
+    view = memoryview(buf)
+    while True:
+        n = fsrc.readinto(buf)
+        if not n:
+            break
+        # raw writes may be partial
+        chunk = view[:n]
+        while chunk:
+            chunk = chunk[fdst.write(chunk):]
+
+def _copyContent(fsrc, fdst):
+    """Copy between unbuffered files using the fastest available method."""
+    inFd, outFd = fsrc.fileno(), fdst.fileno()
+    try:
+        _ficlone(inFd, outFd)
+        return
+    except _GiveupOnFastCopy:
+        pass
+    try:
+        _copyFileRange(inFd, outFd)
+        return
+    except _GiveupOnFastCopy:
+        pass
+    try:
+        _sendfile(inFd, outFd)
+        return
+    except _GiveupOnFastCopy:
+        pass
+    _readinto(fsrc, fdst)
+
+def _checkNotSameFile(srcStat, src, dst, dirFd=None):
+    """Raise shutil.SameFileError if dst (relative to dirFd) is src: opening dst for writing would truncate src."""
+    try:
+        dstStat = os.stat(dst, dir_fd=dirFd)
+    except FileNotFoundError:
+        return
+    if os.path.samestat(srcStat, dstStat):
+        raise shutil.SameFileError(f'{src!r} and {dst!r} are the same file')
+
+def fastCopyFile(src, dst, dirFd=None, addMode=0):
+    """Copy content of file src to dst (like shutil.copyfile) using the fastest available method.
+
+    dst is relative to the open directory dirFd if given, the permission bits addMode are added to dst."""
+    opener = lambda path, flags: os.open(path, flags, 0o666, dir_fd=dirFd)
+    # unbuffered: all methods work on the same file offsets
+    with open(src, 'rb', buffering=0) as fsrc:
+        inFd = fsrc.fileno()
+        # before dst is opened: truncating the same file would lose its content
+        srcStat = os.fstat(inFd)
+        _checkNotSameFile(srcStat, src, dst, dirFd)
+        with open(dst, 'wb', buffering=0, opener=opener) as fdst:
+            outFd = fdst.fileno()
+            if srcStat.st_size <= SMALL_FILE_SIZE:
+                # one read and one write
+                data = os.read(inFd, srcStat.st_size)
+                while data:
+                    data = data[os.write(outFd, data):]
+            else:
+                _copyContent(fsrc, fdst)
+            if addMode:
+                # no path lookup like chmod_add
+                os.fchmod(outFd, stat.S_IMODE(os.fstat(outFd).st_mode) | addMode)
+
+def _fastCopy(src, dst):
+    """Copy file src to dst in the kernel and keep metadata like shutil.copy2."""
+    fastCopyFile(src, dst)
+    shutil.copystat(src, dst)
+
+def runParallel(fn, argsList):
+    """Call fn(*args) for all argument tuples in a thread pool (file I/O releases the GIL) and raise the first error."""
+    if len(argsList) < 2:
+        # no need for threads
+        for args in argsList:
+            fn(*args)
+        return
+    with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4)) as executor:
+        futures = [executor.submit(fn, *args) for args in argsList]
+        wait(futures)
+        for future in futures:
+            future.result()
+
+def _copyTree(srcDir, dstDir):
+    """Copy content of srcDir to dstDir (existing files are overwritten)."""
+    # collect dirs and files first
+    dirs = [(srcDir, dstDir)]
+    files = []
+    i = 0
+    while i < len(dirs):
+        src, dst = dirs[i]
+        i += 1
+        with os.scandir(src) as it:
+            for entry in it:
+                pair = (entry.path, os.path.join(dst, entry.name))
+                if entry.is_dir():
+                    dirs.append(pair)
+                else:
+                    files.append(pair)
+    # create dirs serially (cheap), copy files in parallel (I/O releases the GIL)
+    for src, dst in dirs:
+        os.makedirs(dst, exist_ok=True)
+    runParallel(_fastCopy, files)
+    for src, dst in reversed(dirs):
+        shutil.copystat(src, dst)
+
 def copyFileOrFolder(file, targetDir):
     """Copy file/folder to targetDir and create targetDir if needed."""
     logging.debug(f'Copy {file} to {targetDir}')
     os.makedirs(targetDir, exist_ok=True)
     if os.path.isdir(file):
-        shutil.copytree(file, targetDir, dirs_exist_ok=True)
+        _copyTree(file, targetDir)
     else:
-        shutil.copy2(file, targetDir)
+        _fastCopy(file, os.path.join(targetDir, os.path.basename(file)))
+
+def _move(src, dst, srcIsDir):
+    """Move src to dst (rename if possible) and merge it into an existing folder dst."""
+    dstIsDir = os.path.isdir(dst) and not os.path.islink(dst)
+    if dstIsDir and srcIsDir:
+        moveTree(src, dst)
+        return
+    if dstIsDir:
+        fastRmtree(dst)
+    try:
+        os.replace(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        # different file system: copy and delete
+        if os.path.lexists(dst):
+            os.unlink(dst)
+        shutil.move(src, dst)
+
+def copyFilesToDir(files, targetDir):
+    """Copy files (no folders) to targetDir in parallel. Of files with the same name, the last one wins."""
+    if not files:
+        return
+    os.makedirs(targetDir, exist_ok=True)
+    pairs = {os.path.join(targetDir, os.path.basename(file)): file for file in files}
+    runParallel(_fastCopy, [(src, dst) for dst, src in pairs.items()])
+
+def moveTree(srcDir, dstDir):
+    """Move content of srcDir into dstDir and merge existing folders (rename if possible)."""
+    os.makedirs(dstDir, exist_ok=True)
+    with os.scandir(srcDir) as it:
+        for entry in it:
+            _move(entry.path, os.path.join(dstDir, entry.name), entry.is_dir(follow_symlinks=False))
+
+def moveRelativeFiles(srcRoot, dstRoot, relPaths):
+    """Move files/folders given relative to srcRoot to the same relative path below dstRoot (rename if possible)."""
+    for parent in {os.path.dirname(relPath) for relPath in relPaths}:
+        # create each parent only once
+        os.makedirs(os.path.join(dstRoot, parent), exist_ok=True)
+    for relPath in relPaths:
+        src = os.path.join(srcRoot, relPath)
+        if not os.path.lexists(src):
+            # already moved with its parent folder
+            continue
+        _move(src, os.path.join(dstRoot, relPath), os.path.isdir(src) and not os.path.islink(src))
+
+def iterSubFiles(dir):
+    """Yield all files below dir as paths relative to dir (fd based like os.fwalk)."""
+    stack = [(os.open(dir, os.O_RDONLY | os.O_DIRECTORY), '')]
+    try:
+        while stack:
+            dirFd, prefix = stack.pop()
+            try:
+                subDirs = []
+                with os.scandir(dirFd) as it:
+                    for entry in it:
+                        if not entry.is_dir():
+                            # string concatenation instead of os.path.join
+                            yield prefix + entry.name
+                        elif not entry.is_symlink():
+                            subDirs.append(entry.name)
+                for name in reversed(subDirs):
+                    stack.append((os.open(name, os.O_RDONLY | os.O_DIRECTORY, dir_fd=dirFd), prefix + name + os.sep))
+            finally:
+                os.close(dirFd)
+    finally:
+        for dirFd, prefix in stack:
+            os.close(dirFd)
+
+def iterExecutableFiles(dir, maxDepth=None):
+    """Yield executable files (or links to them) below dir as paths relative to dir, breadth first and up to maxDepth sub folders deep."""
+    queue = deque([(dir, '', 0)])
+    while queue:
+        path, prefix, depth = queue.popleft()
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_dir():
+                    if not entry.is_symlink() and (maxDepth is None or depth < maxDepth):
+                        queue.append((entry.path, prefix + entry.name + os.sep, depth + 1))
+                elif entry.is_file():
+                    try:
+                        mode = entry.stat().st_mode
+                    except OSError:
+                        continue
+                    if mode & (stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH):
+                        yield prefix + entry.name
 
 def getAllSubFiles(dir):
+    """Return all files in dir and its sub folders as paths relative to dir."""
     files = []
-    for (root, dirnames, filenames) in os.walk(dir):
-        files.extend(filenames)
+    files.extend(iterSubFiles(dir))
     return files
 
 def skipContainerDirs(dir):
     """Return dir without single folders."""
     resultDir = dir
-    files = os.listdir(resultDir)
-    while len(files) == 1:
-        fileOrDir = os.path.join(resultDir, files[0])
-        if not os.path.isdir(fileOrDir):
+    while True:
+        # peek at the first two entries only
+        with os.scandir(resultDir) as it:
+            first = next(it, None)
+            second = next(it, None)
+        if first is None or second is not None or not first.is_dir():
             break
         # skip single container dirs
-        resultDir = fileOrDir
-        files = os.listdir(resultDir)
+        resultDir = first.path
     return resultDir
 
+###################################################
+## symlink
+###################################################
+
+def atomicSymlink(src, dst, target_is_directory=False):
+    """Create or replace the symlink dst -> src in one atomic rename. Anything else than a symlink at dst is not replaced."""
+    if os.path.lexists(dst) and not os.path.islink(dst):
+        raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), dst)
+    # unique name in the dir of dst (same file system): a stale tmp link of a killed run does not block
+    for _ in range(tempfile.TMP_MAX):
+        tmp = f'{dst}.opt-tmp-{os.urandom(4).hex()}'
+        try:
+            os.symlink(src, tmp, target_is_directory=target_is_directory)
+            break
+        except FileExistsError:
+            continue
+    else:
+        raise FileExistsError(errno.EEXIST, 'No usable temporary link name', dst)
+    try:
+        os.replace(tmp, dst)
+    except OSError:
+        os.unlink(tmp)
+        raise
+
+###################################################
+## remove
+###################################################
+
+def bulkUnlink(files):
+    """Unlink files/symlinks, opening the parent dir of all files in the same dir only once."""
+    if os.unlink not in os.supports_dir_fd:
+        for file in files:
+            os.unlink(file)
+        return
+    byParent = {}
+    for file in files:
+        parent, name = os.path.split(file)
+        byParent.setdefault(parent, []).append(name)
+    for parent, names in byParent.items():
+        dirFd = os.open(parent, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            for name in names:
+                os.unlink(name, dir_fd=dirFd)
+        finally:
+            os.close(dirFd)
+
+def _rmtreeFd(dirFd):
+    """Remove the content of the open directory dirFd."""
+    # d_type of getdents64 tells dirs from files, no stat per entry
+    with os.scandir(dirFd) as it:
+        entries = [(entry.name, entry.is_dir(follow_symlinks=False)) for entry in it]
+    for name, isDir in entries:
+        if isDir:
+            subFd = os.open(name, os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW, dir_fd=dirFd)
+            try:
+                _rmtreeFd(subFd)
+            finally:
+                os.close(subFd)
+            os.rmdir(name, dir_fd=dirFd)
+        else:
+            # files and symlinks (also to directories)
+            os.unlink(name, dir_fd=dirFd)
+
+def fastRmtree(dir):
+    """Remove dir and its content (names are resolved relative to the parent dir fd)."""
+    if os.scandir not in os.supports_fd or os.unlink not in os.supports_dir_fd:
+        # e.g. Windows
+        return shutil.rmtree(dir)
+    dirFd = os.open(dir, os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW)
+    try:
+        _rmtreeFd(dirFd)
+    finally:
+        os.close(dirFd)
+    os.rmdir(dir)
+
 ###################################################
 ## archives
 ###################################################
 
+# buffer size for copying archive members (library defaults are 8-16 KiB)
+EXTRACT_BUFSIZE = 2 * 1024 * 1024
+
+def _zipMemberPath(targetDir, name):
+    """Return the sanitized target path of a zip member (same rules as ZipFile.extract)."""
+    parts = [p for p in name.split('/') if p not in ('', '.', '..')]
+    return os.path.join(targetDir, *parts)
+
+def _extractZipMember(zip, info, targetDir):
+    with zip.open(info) as src, open(_zipMemberPath(targetDir, info.filename), 'wb') as dst:
+        shutil.copyfileobj(src, dst, EXTRACT_BUFSIZE)
+
+def _getZipFiles(file):
+    # reads the central directory only
+    with zipfile.ZipFile(file) as zip:
+        return zip.namelist()
+
+def _extractZip(file, targetDir):
+    """Extract zip members in parallel (inflate releases the GIL)."""
+    with zipfile.ZipFile(file) as zip:
+        members = zip.infolist()
+        # create directory tree up front to avoid racing makedirs in the workers
+        dirs = set()
+        for info in members:
+            dirs.add(_zipMemberPath(targetDir, info.filename if info.is_dir() else os.path.dirname(info.filename)))
+        for dir in sorted(dirs):
+            os.makedirs(dir, exist_ok=True)
+        # duplicate names would be written concurrently to the same path: the last member wins like extractall
+        files = {_zipMemberPath(targetDir, info.filename): info for info in members if not info.is_dir()}.values()
+    # ZipFile.open() is not thread-safe (shared file position and reference count): one handle per worker
+    local = threading.local()
+    handles = []
+    def extract(info):
+        zip = getattr(local, 'zip', None)
+        if zip is None:
+            zip = local.zip = zipfile.ZipFile(file)
+            handles.append(zip)
+        _extractZipMember(zip, info, targetDir)
+    try:
+        with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as executor:
+            # list() propagates exceptions of the workers
+            list(executor.map(extract, files))
+    finally:
+        for zip in handles:
+            zip.close()
+
+def _getTarFiles(file):
+    # stream forward once instead of building the seekable member index
+    with tarfile.open(file, 'r|*', bufsize=EXTRACT_BUFSIZE) as tar:
+        return [member.name for member in tar]
+
+def _extractTar(file, targetDir):
+    # stream mode decompresses once: the seekable mode scans all members first and seeks back for every member
+    # (compressed streams restart decompression on backward seeks); directory attributes are set at the end by extractall
+    with tarfile.open(file, 'r|*', bufsize=EXTRACT_BUFSIZE, copybufsize=EXTRACT_BUFSIZE) as tar:
+        tar.extractall(targetDir)
+
+@lru_cache(maxsize=None)
+def _findProgram(name):
+    """Return the path of an external program or None (looked up once)."""
+    return shutil.which(name)
+
+def _extractTarPipe(cmd, file, targetDir):
+    """Decompress with an external program (all cores) and stream its output into tarfile."""
+    with subprocess.Popen(cmd + [file], stdout=subprocess.PIPE, bufsize=EXTRACT_BUFSIZE) as proc:
+        try:
+            with tarfile.open(fileobj=proc.stdout, mode='r|', copybufsize=EXTRACT_BUFSIZE) as tar:
+                tar.extractall(targetDir)
+            # tarfile stops at the end-of-archive marker: read the record padding (or trailing data) too,
+            # closing the pipe early kills the program with SIGPIPE
+            while proc.stdout.read(EXTRACT_BUFSIZE):
+                pass
+        except BaseException:
+            proc.kill()
+            raise
+    if proc.returncode != 0:
+        raise tarfile.ReadError(f'{cmd[0]} failed with exit code {proc.returncode}: {file}')
+
+def _extractTarXz(file, targetDir):
+    # lzma decompresses on one core only
+    xz = _findProgram('xz')
+    if xz is None:
+        return _extractTar(file, targetDir)
+    _extractTarPipe([xz, '-T0', '-d', '-c', '--'], file, targetDir)
+
+def _extractTarGz(file, targetDir):
+    if rapidgzip is None:
+        return _extractTar(file, targetDir)
+    # inflate on all cores and stream the result into tarfile
+    with rapidgzip.open(file, parallelization=os.cpu_count() or 1) as gz, tarfile.open(fileobj=gz, mode='r|', copybufsize=EXTRACT_BUFSIZE) as tar:
+        tar.extractall(targetDir)
+
+def _extractTarBz2(file, targetDir):
+    if indexed_bzip2 is None:
+        lbzip2 = _findProgram('lbzip2')
+        if lbzip2 is None:
+            return _extractTar(file, targetDir)
+        return _extractTarPipe([lbzip2, '-d', '-c', '--'], file, targetDir)
+    with indexed_bzip2.open(file, parallelization=os.cpu_count() or 1) as bz2, tarfile.open(fileobj=bz2, mode='r|', copybufsize=EXTRACT_BUFSIZE) as tar:
+        tar.extractall(targetDir)
+
+# suffix -> (getFiles, extract)
+_ARCHIVE_HANDLERS = {
+    '.zip': (_getZipFiles, _extractZip),
+    '.tar': (_getTarFiles, _extractTar),
+    '.tar.gz': (_getTarFiles, _extractTarGz),
+    '.tgz': (_getTarFiles, _extractTarGz),
+    '.tar.bz2': (_getTarFiles, _extractTarBz2),
+    '.tar.xz': (_getTarFiles, _extractTarXz),
+}
+# longest suffix first
+_ARCHIVE_SUFFIXES = tuple(sorted(_ARCHIVE_HANDLERS, key=len, reverse=True))
+
+@lru_cache(maxsize=1024)
+def _archiveKind(name):
+    """Return the archive suffix of the file name (case-sensitive) or None."""
+    return next((s for s in _ARCHIVE_SUFFIXES if name.endswith(s)), None)
+
+def _matchSuffix(file):
+    """Return the handlers for the archive suffix of file or None."""
+    return _ARCHIVE_HANDLERS.get(_archiveKind(os.path.basename(file)))
+
 def isArchiveFile(file):
     """Indicate if file in an archive."""
-    return file.endswith('.zip') or file.endswith('.tar.bz2') or file.endswith(".tar") or file.endswith(".tar.gz") or file.endswith(".tgz") or file.endswith(".tar.xz")
+    return _archiveKind(os.path.basename(file)) is not None
 
 def getArchiveFiles(file):
     """Return files in archive or empty list if file is no archive."""
-    if file.endswith('.zip'):
-        with zipfile.ZipFile(file) as zip:
-            return zip.namelist()
-    elif file.endswith('.tar.bz2') or file.endswith(".tar") or file.endswith(".tar.gz") or file.endswith(".tgz") or file.endswith(".tar.xz"):
-        with tarfile.open(file, 'r') as tar:
-            return tar.getnames()
-    return []
+    handler = _matchSuffix(file)
+    return handler[0](file) if handler else []
 
 def extractArchive(file, targetDir):
     """Copy file to dir or extract the file if it is an archive."""
-    if file.endswith('.zip'):
-        with zipfile.ZipFile(file) as zip:
-            zip.extractall(targetDir)
-    elif file.endswith('.tar.bz2') or file.endswith(".tar") or file.endswith(".tar.gz") or file.endswith(".tgz") or file.endswith(".tar.xz"):
-        with tarfile.open(file, 'r') as tar:
-            tar.extractall(targetDir)
+    handler = _matchSuffix(file)
+    if handler:
+        handler[1](file, targetDir)
 
 ###################################################
 ## chown
 ###################################################
 
+def _walkFd(dirFd):
+    """Yield (dirFd, entry) for all entries below the directory opened as dirFd."""
+    with os.scandir(dirFd) as it:
+        for entry in it:
+            yield dirFd, entry
+            if entry.is_dir(follow_symlinks=False):
+                subFd = os.open(entry.name, os.O_RDONLY | os.O_DIRECTORY, dir_fd=dirFd)
+                try:
+                    yield from _walkFd(subFd)
+                finally:
+                    os.close(subFd)
+
 def chown_recursively(dir, uid=0, gid=0, follow_symlinks=False):
     """Set owner of complete dir to the given value."""
-    # Change permissions for the top-level folder
-    #os.chmod(path, 502, 20)
-    os.chown(dir, uid, gid, follow_symlinks)
-
-    for root, dirs, files in os.walk(path):
-      for dir in dirs:
-        os.chown(os.path.join(root, dir), uid, gid, follow_symlinks)
-      for file in files:
-        os.chown(os.path.join(root, file), uid, gid, follow_symlinks)
-
+    os.chown(dir, uid, gid, follow_symlinks=follow_symlinks)
+    # resolve names relative to the parent dir fd instead of full paths
+    dirFd = os.open(dir, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        for fd, entry in _walkFd(dirFd):
+            os.chown(entry.name, uid, gid, dir_fd=fd, follow_symlinks=follow_symlinks)
+    finally:
+        os.close(dirFd)
@@ -29,7 +29,12 @@ function _opt() {
             install | update | remove | desktop | autocomplete | path | list | "alias")
                 local installDir="/opt/.installer/"
                 if [ -d $installDir ]; then
-                    appdirs=($(find $installDir -mindepth 1 -maxdepth 1 -type d -printf '%f '))
+                    # glob instead of spawning find on every <TAB> (dirs only, no links)
+                    local appdirs=()
+                    for d in "$installDir"*/; do
+                        d="${d%/}"
+                        [ -d "$d" ] && [ ! -L "$d" ] && appdirs+=("${d##*/}")
+                    done
                     words="-h --help ${appdirs[@]}"
                 else
                     filesAllowed=true
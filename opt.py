@@ -4,12 +4,10 @@ import argparse
 import logging
 import os
 import stat
-import traceback
-import tempfile
+import sys
+from collections import defaultdict, namedtuple
+from functools import cached_property, lru_cache
 from enum import Enum
-import shutil
-import fileutil
-from textwrap import dedent
 
 """
 History:
@@ -19,6 +17,7 @@ History:
 2023-07-22  check for unmanaged apps + complete refactoring
 """
 
+# all target dirs must be absolute paths (joined paths are only normalized)
 OPT_DIR = '/opt'
 BIN_DIR = '/usr/local/bin/'
 DESKTOP_DIR = '/usr/share/applications/'
@@ -26,6 +25,9 @@ AUTOCOMPLETE_DIR = '/etc/bash_completion.d'
 ICON_DIR = '/usr/share/pixmaps/'
 INSTALL_DIR = os.path.join(OPT_DIR, '.installer')
 
+# sub folder levels of an archive searched for an executable for $PATH
+PATH_SEARCH_DEPTH = 4
+
 # ANSI colors
 ANSI_BOLD = '\033[1m'
 ANSI_END = '\033[0m'
@@ -46,21 +48,137 @@ CMD_AUTOCOMPLETE = 'autocomplete'
 CMD_MENU_DEPRECATED = "menu"
 CMD_ALIAS = 'alias'
 CMD_PATH = 'path'
+# commands changing system directories (list is read-only)
+_ROOT_CMDS = frozenset([CMD_INSTALL, CMD_UPDATE, CMD_REMOVE, CMD_DESKTOP, CMD_AUTOCOMPLETE, CMD_ALIAS, CMD_PATH])
+# commands writing a log file
+LOG_COMMANDS = [CMD_INSTALL, CMD_UPDATE, CMD_ALIAS, CMD_DESKTOP, CMD_AUTOCOMPLETE, CMD_MENU_DEPRECATED, CMD_PATH]
 
 class OptError(Exception):
     def __init__(self, msg, items=[]):
         self.msg = msg
         self.items = sorted(items)
 
+# result of _statOnce(): exists/isDir follow symlinks like os.path.exists/os.path.isdir
+FileStat = namedtuple('FileStat', ['exists', 'isLink', 'isDir'])
+
+# stat results of the current command incl. non-existing paths: path -> FileStat, see _clearStatCache()
+_statCache = {}
+
+# dirs whose entries are all in _statCache (paths not cached do not exist)
+_scannedDirs = set()
+
+def _statOnce(path):
+    """Return FileStat of path using a single lstat (and a stat for symlinks)."""
+    fileStat = _statCache.get(path)
+    if fileStat is None:
+        if os.path.dirname(path) in _scannedDirs:
+            fileStat = FileStat(False, False, False)
+        else:
+            fileStat = _statCache[path] = _statPath(path)
+    return fileStat
+
+def _statPath(path):
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return FileStat(False, False, False)
+    if not stat.S_ISLNK(st.st_mode):
+        return FileStat(True, False, stat.S_ISDIR(st.st_mode))
+    try:
+        st = os.stat(path)
+    except OSError:
+        # broken link
+        return FileStat(False, True, False)
+    return FileStat(True, True, stat.S_ISDIR(st.st_mode))
+
+def _statEntry(entry):
+    """Return FileStat of a DirEntry using the stat cached by os.scandir (and remember it)."""
+    if not entry.is_symlink():
+        fileStat = FileStat(True, False, entry.is_dir(follow_symlinks=False))
+    else:
+        try:
+            st = entry.stat()
+            fileStat = FileStat(True, True, stat.S_ISDIR(st.st_mode))
+        except OSError:
+            fileStat = FileStat(False, True, False)
+    _statCache[entry.path] = fileStat
+    return fileStat
+
+def _statDir(dir):
+    """Stat all entries of dir with one os.scandir (results are cached)."""
+    try:
+        with os.scandir(dir) as it:
+            for entry in it:
+                _statEntry(entry)
+    except FileNotFoundError:
+        # nothing below dir exists
+        pass
+    _scannedDirs.add(dir)
+
+def _exists(path):
+    return _statOnce(path).exists
+
+def _lexists(path):
+    fileStat = _statOnce(path)
+    return fileStat.exists or fileStat.isLink
+
+@lru_cache(maxsize=None)
+def _isRoot():
+    return os.geteuid() == 0
+
+def _clearStatCache():
+    """Forget cached stat results and the applications built from them (file system may have changed)."""
+    _statCache.clear()
+    _scannedDirs.clear()
+    Application._registry.clear()
+
+# log files of the current command: log file -> (fd, pending lines)
+_logs = {}
+
+def _openLog(logFile):
+    """Open logFile for appending before the files are changed (fails early like open(logFile, 'a')) and return it."""
+    if logFile not in _logs:
+        _logs[logFile] = (os.open(logFile, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666), [])
+    return logFile
+
+def _writeLog(logFile, file):
+    """Append file to logFile. The entries are collected and written by _flushLogs()."""
+    _logs[_openLog(logFile)][1].append(f'{file}\n')
+
+def _flushLogs():
+    """Write the pending entries of each log file with a single write and close the log files."""
+    try:
+        for fd, lines in _logs.values():
+            data = ''.join(lines).encode('utf-8', 'surrogateescape')
+            while data:
+                data = data[os.write(fd, data):]
+    finally:
+        for fd, lines in _logs.values():
+            os.close(fd)
+        _logs.clear()
+
+def _readLogLines(logFile):
+    """Return the entries of a log file."""
+    fd = os.open(logFile, os.O_RDONLY)
+    try:
+        # read the whole log with one syscall
+        data = os.read(fd, os.fstat(fd).st_size)
+    finally:
+        os.close(fd)
+    lines = data.decode('utf-8', 'surrogateescape').split('\n')
+    # remove empty lines and duplicates but keep order
+    return list(dict.fromkeys(line for line in lines if line))
+
 class FileOp:
     """File operation with source/destination files."""
     def __init__(self, file, targetDir, targetFileName=None, alias=False):
         self.src = os.path.abspath(file)
         if targetFileName:
-            self.dst = os.path.abspath(os.path.join(targetDir, targetFileName))
+            self.dst = os.path.normpath(os.path.join(targetDir, targetFileName))
         else:
-            self.dst = os.path.abspath(os.path.join(targetDir, os.path.basename(file)))
+            self.dst = os.path.normpath(os.path.join(targetDir, os.path.basename(file)))
         self.alias = alias
+        self._dstExists = None
     
     def __str__(self):
         exists = f'{ANSI_RED}!' if self.existsDst() else ''
@@ -73,7 +191,14 @@ class FileOp:
         return self.src < other.src
     
     def existsDst(self):
-        return os.path.exists(self.dst) or os.path.islink(self.dst)
+        # checked once: lstat covers broken links too
+        if self._dstExists is None:
+            self._dstExists = _lexists(self.dst)
+        return self._dstExists
+
+    def invalidate(self):
+        """Forget if dst exists (after dst has been changed)."""
+        self._dstExists = None
 
 class ApplicationState(Enum):
     NEW = 1
@@ -82,48 +207,90 @@ class ApplicationState(Enum):
     UNMANAGED = 4
     
     def __str__(self):
-        if self == ApplicationState.UNMANAGED:
-            ansiColor = ANSI_MAGENTA
-        elif self == ApplicationState.ALIAS:
-            ansiColor = ANSI_YELLOW
-        else:
-            ansiColor = ANSI_CYAN
-        return f'{ansiColor}{self.name}{ANSI_END}'
-    
+        return ApplicationState._STR_CACHE[self]
+
+# colored names are created only once
+ApplicationState._STR_CACHE = {s: f'{ansiColor}{s.name}{ANSI_END}' for s, ansiColor in [
+    (ApplicationState.NEW, ANSI_CYAN),
+    (ApplicationState.INSTALLED, ANSI_CYAN),
+    (ApplicationState.ALIAS, ANSI_YELLOW),
+    (ApplicationState.UNMANAGED, ANSI_MAGENTA),
+]}
+
 class Application:
-    def __init__(self, name):
+    # applications of the current command: name -> Application, see _clearStatCache()
+    _registry = {}
+
+    def __init__(self, name, appDirStat=None):
         self.name = name
-        self.appDir = os.path.abspath(os.path.join(OPT_DIR, name)) # /opt/<name>
-        self.appInstallDir = os.path.abspath(os.path.join(INSTALL_DIR, name)) # /opt/.installer/<name>
-        appDirExists = os.path.exists(self.appDir)
-        appInstallDirExists = os.path.exists(self.appInstallDir)
-        if appDirExists != appInstallDirExists:
+        self.appDir = os.path.normpath(os.path.join(OPT_DIR, name)) # /opt/<name>
+        self._appDirPrefix = self.appDir + os.sep
+        self.appInstallDir = os.path.normpath(os.path.join(INSTALL_DIR, name)) # /opt/.installer/<name>
+        self.appDirStat = appDirStat if appDirStat else _statOnce(self.appDir)
+        self._logs = None
+        self.appInstallDirStat = _statOnce(self.appInstallDir)
+        if self.appDirStat.exists != self.appInstallDirStat.exists:
             self.state = ApplicationState.UNMANAGED
-        elif appDirExists:
-            if os.path.exists(self.getLogFile(CMD_ALIAS)):
+        elif self.appDirStat.exists:
+            if _exists(self.getLogFile(CMD_ALIAS)):
                 self.state = ApplicationState.ALIAS 
-                self.aliasTarget = os.path.realpath(self.appInstallDir)
             else: 
                 self.state = ApplicationState.INSTALLED
-                self.aliasTarget = None
         else:
             self.state = ApplicationState.NEW
 
+    @cached_property
+    def aliasTarget(self):
+        # resolved only if needed, at most once
+        return os.path.realpath(self.appInstallDir) if self.state == ApplicationState.ALIAS else None
+
+    @classmethod
+    def get(cls, name):
+        """Return the application with the given name (created once per command)."""
+        app = cls._registry.get(name)
+        if app is None:
+            app = cls._registry[name] = cls(name)
+        return app
+
+    @classmethod
+    def fromEntry(cls, entry):
+        """Create application from a DirEntry of OPT_DIR (reuses the stat of os.scandir)."""
+        app = cls._registry[entry.name] = cls(entry.name, _statEntry(entry))
+        return app
+
     def isAppFile(self, file):
-        return os.path.abspath(file).startswith(self.appDir)
+        # abspath does not call getcwd() for absolute paths, the separator excludes /opt/<name>xyz
+        file = os.path.abspath(file)
+        return file == self.appDir or file.startswith(self._appDirPrefix)
 
     def getLogFile(self, command):
         return os.path.join(INSTALL_DIR, f'{self.name}.{command}')
     
+    def _loadAllLogs(self):
+        """Read all log files of this application (INSTALL_DIR is scanned once per command): command -> lines."""
+        if self._logs is None:
+            self._logs = {}
+            if INSTALL_DIR not in _scannedDirs:
+                _statDir(INSTALL_DIR)
+            # missing log files are known from the scan, only existing ones are opened
+            for command in LOG_COMMANDS:
+                logFile = self.getLogFile(command)
+                if _exists(logFile):
+                    self._logs[command] = _readLogLines(logFile)
+        return self._logs
+
     def readLogFile(self, command):
-        logFile = self.getLogFile(command)
-        if not os.path.exists(logFile):
-            return []
-        with open(logFile, "r") as log:
-            return log.read().splitlines()
+        return self._loadAllLogs().get(command, [])
+    
+    def readLogFiles(self, commands):
+        """Return the existing log files of the given commands and the set of their entries."""
+        logs = self._loadAllLogs()
+        logFiles = [self.getLogFile(c) for c in commands if c in logs]
+        files = {line for c in commands for line in logs.get(c, [])}
+        return logFiles, files
     
-    def printShortSummary(self):
-        print(f'{str(self):<35} {str(self.state):<20} {self.appInstallDir}')
+    def getShortSummary(self):
+        return f'{str(self):<35} {str(self.state):<20} {self.appInstallDir}'
     
     def printSummary(self):
         dirs = []
@@ -136,14 +303,7 @@ class Application:
         print()
     
     def printDetails(self):
-        files = []
-        files.extend(self.readLogFile(CMD_INSTALL))
-        files.extend(self.readLogFile(CMD_UPDATE))
-        files.extend(self.readLogFile(CMD_ALIAS))
-        files.extend(self.readLogFile(CMD_DESKTOP))
-        files.extend(self.readLogFile(CMD_AUTOCOMPLETE))
-        files.extend(self.readLogFile(CMD_MENU_DEPRECATED))
-        files.extend(self.readLogFile(CMD_PATH))
+        logFiles, files = self.readLogFiles(LOG_COMMANDS)
         existing, nonExisting = _validateFiles(files, brokenLinks=True)
         existing.sort()
         if files:
@@ -153,8 +313,10 @@ class Application:
         return f'{ANSI_BOLD}{self.name}{ANSI_END}'
 
 class EmptyTask:
+    overwrite = False
+
     def printSummary(self):
-        self.overwrite = False
+        pass
         
     def execute(self):
         pass
@@ -172,6 +334,9 @@ class InstallTask:
         self.app = app
         self.files = files
         self.files.sort()
+        import fileutil
+        # classify the files only once (archives are extracted, other files are copied)
+        self.archives = {f for f in files if fileutil.isArchiveFile(f)}
         self.update = update
         self.delete = delete
         self.keep = []
@@ -184,6 +349,17 @@ class InstallTask:
             else:
                 self.keep.append(e)
         self.keep.sort()
+        # (archive, TemporaryDirectory) already extracted by the $PATH auto-detection
+        self._prefetch = None
+    
+    def useExtracted(self, file, tmpDir):
+        """Install the archive file from tmpDir (TemporaryDirectory), it was already extracted there."""
+        self._prefetch = (file, tmpDir)
+
+    def cleanup(self):
+        if self._prefetch is not None:
+            self._prefetch[1].cleanup()
+            self._prefetch = None
     
     def getTargetFile(self, file, fileInArchive=None):
         if file in self.files:
@@ -197,52 +373,89 @@ class InstallTask:
             _printList(f'Delete content of "{self.app.appInstallDir}"{keepMsg}', self.keep)
         _printList(f'Copy files to "{self.app.appInstallDir}":', self.files)
         print(f'Create symlink "{self.app.appDir}"')
+    
+    def _installFiles(self):
+        """Copy/extract files to the install dir and create the application symlink."""
+        import fileutil
+        if self.delete and self.app.appInstallDirStat.exists:
+            fileutil.fastRmtree(self.app.appInstallDir)
+        os.makedirs(self.app.appInstallDir, exist_ok=True)
+        # copy files (consecutive plain files are copied together, the order of overwrites remains)
+        plainFiles = []
+        for file in self.files:
+            isArchive = file in self.archives
+            if not isArchive and not _statOnce(file).isDir:
+                plainFiles.append(file)
+                continue
+            fileutil.copyFilesToDir(plainFiles, self.app.appInstallDir)
+            plainFiles = []
+            if self._prefetch is not None and file == self._prefetch[0]:
+                # archive was extracted before, move its content
+                fileutil.moveTree(self._prefetch[1].name, self.app.appInstallDir)
+            elif isArchive:
+                fileutil.extractArchive(file, self.app.appInstallDir)
+            else:
+                fileutil.copyFileOrFolder(file, self.app.appInstallDir)
+        fileutil.copyFilesToDir(plainFiles, self.app.appInstallDir)
+        # set owner
+        #fileutil.chown_recursively(self.app.appInstallDir)
+        # create or replace symlink
+        symlinkSrc = fileutil.skipContainerDirs(self.app.appInstallDir)
+        fileutil.atomicSymlink(symlinkSrc, self.app.appDir, target_is_directory=True)
         
     def execute(self):
+        import fileutil
+        import tempfile
         # ensure install dir is created
         os.makedirs(INSTALL_DIR, exist_ok=True)
     
-        logFile = self.app.getLogFile(CMD_UPDATE if self.update else CMD_INSTALL)
-        with open(logFile, 'a') as log, tempfile.TemporaryDirectory() as tmpDir:
-            logging.debug(f'Use temporary directory: {tmpDir}')
-            # save files to keep
-            for e in self.keep:
-                tmpRelPath = os.path.relpath(e, start=self.app.appDir) # /opt/name/folder/file.ext -> folder/file.ext
-                tmpFile = os.path.join(tmpDir, tmpRelPath) # folder/file -> <tmpDir>/folder/file
-                fileutil.copyFileOrFolder(e, os.path.dirname(tmpFile) if os.path.isfile(e) else tmpFile)
-            
-            if self.delete and os.path.exists(self.app.appInstallDir):
-                shutil.rmtree(self.app.appInstallDir)
-            os.makedirs(self.app.appInstallDir, exist_ok=True)
-            # copy files
-            for file in self.files:
-                if fileutil.isArchiveFile(file):
-                    fileutil.extractArchive(file, self.app.appInstallDir)
-                else:
-                    fileutil.copyFileOrFolder(file, self.app.appInstallDir)
-            # set owner
-            #fileutil.chown_recursively(self.app.appInstallDir)
-            # create symlink
-            if os.path.islink(self.app.appDir):
-                os.unlink(self.app.appDir) 
-            symlinkSrc = fileutil.skipContainerDirs(self.app.appInstallDir)
-            os.symlink(symlinkSrc, self.app.appDir, target_is_directory=True)
-            # restore files to keep
-            fileutil.copyFileOrFolder(tmpDir, self.app.appInstallDir)
-            
-            # _save_log
-            log.write(f'{self.app.appInstallDir}\n')
-            log.write(f'{self.app.appDir}\n')
+        logFile = _openLog(self.app.getLogFile(CMD_UPDATE if self.update else CMD_INSTALL))
+        if self.keep:
+            # same file system as the application files: files to keep are renamed, not copied
+            with tempfile.TemporaryDirectory(prefix='.keep-', dir=INSTALL_DIR) as tmpDir:
+                logging.debug(f'Use temporary directory: {tmpDir}')
+                # move files to keep out of the way
+                keepRelPaths = [os.path.relpath(e, start=self.app.appDir) for e in self.keep] # /opt/name/folder/file.ext -> folder/file.ext
+                fileutil.moveRelativeFiles(self.app.appDir, tmpDir, keepRelPaths) # folder/file -> <tmpDir>/folder/file
+                try:
+                    self._installFiles()
+                finally:
+                    # restore files to keep (also if the installation failed)
+                    fileutil.moveRelativeFiles(tmpDir, self.app.appDir, keepRelPaths)
+        else:
+            # nothing to save and restore
+            self._installFiles()
+        _writeLog(logFile, self.app.appInstallDir)
+        _writeLog(logFile, self.app.appDir)
 
         # set permisions (does not work in with section)
         os.chmod(self.app.appInstallDir, 0o755)
+        # files have changed
+        _clearStatCache()
+
+def _candidateKey(file, appName):
+    """Score a file in an archive for $PATH (lower is better): same prefix as application, low depth, short name."""
+    dirName, baseName = os.path.split(file)
+    return (1 if baseName.startswith(appName) else 100) + len(dirName)*10 + len(baseName)
+
+def _bestCandidate(files, appName):
+    """Return the file with the lowest _candidateKey() or None (stops at a perfect match)."""
+    best = bestKey = None
+    for file in files:
+        if file == appName:
+            # same name in the top folder has the lowest possible key
+            return file
+        key = _candidateKey(file, appName)
+        if bestKey is None or key < bestKey:
+            best, bestKey = file, key
+    return best
 
 def installOrUpdate(args, update):
-    existing, nonExisting = _validateFiles(args.file)
-    if nonExisting:
-        raise OptError('File(s) do not exist:', nonExisting)
+    import fileutil
+    import tempfile
+    existing = _existingFiles(args.file)
     # app
-    app = Application(args.name)
+    app = Application.get(args.name)
     # install
     keepFiles = args.keep if update and args.keep is not None else []
     install = InstallTask(app, existing, update, update and args.delete, keepFiles)
@@ -253,23 +466,30 @@ def installOrUpdate(args, update):
         path = EmptyTask()
         
         # try to auto-detect best matching executable for $PATH
-        installFiles = install.files.copy()
-        installFiles.sort(key=lambda f: (1 if os.path.basename(f).startswith(app.name) else 100) + len(f)) # Prefer files with same prefix as application
+        installFiles = sorted(install.files, key=lambda f: (1 if os.path.basename(f).startswith(app.name) else 100) + len(f)) # Prefer files with same prefix as application
         logging.debug(f'File for path: {installFiles}')
         for installFile in installFiles:
-            if fileutil.isArchiveFile(installFile):
-                with tempfile.TemporaryDirectory() as tmpDir:
-                    fileutil.extractArchive(installFile, tmpDir)
+            if installFile in install.archives:
+                # in the install dir (same file system): the extracted files are renamed, not copied
+                os.makedirs(INSTALL_DIR, exist_ok=True)
+                tmpDir = tempfile.TemporaryDirectory(prefix='.probe-', dir=INSTALL_DIR)
+                try:
+                    fileutil.extractArchive(installFile, tmpDir.name)
                     # skip single container dirs
-                    archiveDir = fileutil.skipContainerDirs(tmpDir)
-                    fileCandidates = fileutil.getAllSubFiles(archiveDir)
-                    if fileCandidates:
-                        logging.debug(f'Archive file candidates: {fileCandidates}')
-                        fileCandidates.sort(key=lambda f: (1 if os.path.basename(f).startswith(app.name) else 100) + len(os.path.dirname(f))*10 + len(os.path.basename(f)))
-                        fileInArchive = fileCandidates[0]
-                        target = install.getTargetFile(installFile, fileInArchive)
-                        path = PathTask(app, target, checkTarget=False)
-                        break
+                    archiveDir = fileutil.skipContainerDirs(tmpDir.name)
+                    # stream the executable files, only the best candidate is needed (deep files are unlikely to win)
+                    fileInArchive = _bestCandidate(fileutil.iterExecutableFiles(archiveDir, PATH_SEARCH_DEPTH), app.name)
+                except BaseException:
+                    tmpDir.cleanup()
+                    raise
+                if fileInArchive is not None:
+                    logging.debug(f'Best archive file candidate: {fileInArchive}')
+                    # reuse the extracted files for the installation (removed by install.cleanup())
+                    install.useExtracted(installFile, tmpDir)
+                    target = install.getTargetFile(installFile, fileInArchive)
+                    path = PathTask(app, target, checkTarget=False)
+                    break
+                tmpDir.cleanup()
             else:
                 if os.access(installFile, os.X_OK):
                     logging.debug(f'Executable file found: {installFile}')
@@ -277,15 +497,11 @@ def installOrUpdate(args, update):
                     path = PathTask(app, target, checkTarget=False)
                     break
     
-    app.printSummary()
-    install.printSummary()
-    path.printSummary()
-    print()
-    overwriteMsg = f' (overwrite existing files marked with prefix "!")' if path.overwrite else ''
-    doContinue = True if args.noPrompt else getYesOrNo(f'Do you want to continue{overwriteMsg}?', True)
-    if doContinue:
-        install.execute()
-        path.execute()
+    try:
+        overwriteMsg = f' (overwrite existing files marked with prefix "!")' if path.overwrite else ''
+        _confirmAndExecute(args, [app, install, path], [install, path], f'Do you want to continue{overwriteMsg}?', True)
+    finally:
+        install.cleanup()
 
 class PathTask:
     def __init__(self, app, target, linkName=None, checkTarget=True):
@@ -308,39 +524,31 @@ class PathTask:
         _printList(f'Add to $PATH by creating alias in "{BIN_DIR}":', [self.op])
         
     def execute(self):
-        logFile = self.app.getLogFile(CMD_PATH)
-        with open(logFile, 'a') as log:
-            # src : the target of the symlink
-            # dst : the new destination, which didn't exist previously (= new symlink)
-            logging.debug('Path src: ' + self.op.src)
-            logging.debug('Path dst/symlink: ' + self.op.dst)
-            # check target (disabled for auto-detect in install)
-            if not os.path.exists(self.op.src): 
-                print(f'Warning: Alias could not be created because "{self.op.src}" does not exist')
-                return
-            if not os.access(self.op.src, os.X_OK):
-                print(f'Warning: Alias could not be created because "{self.op.src}" is not executable')
-                return
-            # remove old alias if exists
-            if os.path.islink(self.op.dst): 
-                os.unlink(self.op.dst) 
-            os.symlink(self.op.src, self.op.dst, target_is_directory=False)
-            log.write(f'{self.op.dst}\n')
+        logFile = _openLog(self.app.getLogFile(CMD_PATH))
+        import fileutil
+        # src : the target of the symlink
+        # dst : the new destination, which didn't exist previously (= new symlink)
+        logging.debug('Path src: ' + self.op.src)
+        logging.debug('Path dst/symlink: ' + self.op.dst)
+        # check target (disabled for auto-detect in install)
+        if not os.path.exists(self.op.src): 
+            print(f'Warning: Alias could not be created because "{self.op.src}" does not exist')
+            return
+        if not os.access(self.op.src, os.X_OK):
+            print(f'Warning: Alias could not be created because "{self.op.src}" is not executable')
+            return
+        # create alias or replace the old one
+        fileutil.atomicSymlink(self.op.src, self.op.dst, target_is_directory=False)
+        self.op.invalidate()
+        _writeLog(logFile, self.op.dst)
 
 def path(args):
-    existing, nonExisting = _validateFiles([args.file])
-    if nonExisting:
-        raise OptError('File(s) do not exist:', nonExisting)
-    app = Application(args.name)
+    existing = _existingFile(args.file)
+    app = Application.get(args.name)
     linkName = args.linkName if args.linkName else None
-    path = PathTask(app, existing[0], linkName)
+    path = PathTask(app, existing, linkName)
 
-    app.printSummary()
-    path.printSummary()
-    print()
-    doContinue = True if args.noPrompt or not path.overwrite else getYesOrNo('Overwrite existing files marked with prefix "!"?', False)
-    if doContinue:
-        path.execute()
+    _confirmAndExecute(args, [app, path], [path], _OVERWRITE_QUESTION, needsPrompt=path.overwrite)
 
 class RemoveTask:
     def __init__(self, app, desktopOnly, pathOnly, force):
@@ -350,31 +558,21 @@ class RemoveTask:
             raise OptError(f'Application "{app.name}" does not exist')
         self.app = app
         removeAll = not desktopOnly and not pathOnly
-        files = []
-        logFiles = []
+        commands = []
         if removeAll:
-            files.append(app.appDir)
-            files.append(app.appInstallDir)
-            files.extend(app.readLogFile(CMD_INSTALL))
-            files.extend(app.readLogFile(CMD_UPDATE))
-            files.extend(app.readLogFile(CMD_ALIAS))
-            files.extend(app.readLogFile(CMD_AUTOCOMPLETE))
-            logFiles.append(app.getLogFile(CMD_INSTALL))
-            logFiles.append(app.getLogFile(CMD_UPDATE))
-            logFiles.append(app.getLogFile(CMD_ALIAS))
-            logFiles.append(app.getLogFile(CMD_AUTOCOMPLETE))
+            commands.extend([CMD_INSTALL, CMD_UPDATE, CMD_ALIAS, CMD_AUTOCOMPLETE])
         if removeAll or desktopOnly:
-            files.extend(app.readLogFile(CMD_DESKTOP))
-            files.extend(app.readLogFile(CMD_MENU_DEPRECATED))
-            logFiles.append(app.getLogFile(CMD_DESKTOP))
-            logFiles.append(app.getLogFile(CMD_MENU_DEPRECATED))
+            commands.extend([CMD_DESKTOP, CMD_MENU_DEPRECATED])
         if removeAll or pathOnly:
-            files.extend(app.readLogFile(CMD_PATH))
-            logFiles.append(app.getLogFile(CMD_PATH))
-        existing, nonExisting = _validateFiles(set(files), brokenLinks=True)
+            commands.append(CMD_PATH)
+        # log files found by the directory scan exist, no need to validate them again
+        logFiles, files = app.readLogFiles(commands)
+        if removeAll:
+            files.update((app.appDir, app.appInstallDir))
+        # one validation pass over the merged set
+        existing, nonExisting = _validateFiles(files, brokenLinks=True)
         self.files = sorted(existing)
-        existing, nonExisting = _validateFiles(set(logFiles), brokenLinks=True)
-        self.logFiles = sorted(existing)
+        self.logFiles = sorted(logFiles)
         self.empty = not self.files and not self.logFiles
         
     def printSummary(self):
@@ -386,46 +584,50 @@ class RemoveTask:
             print('No files to delete')
         
     def execute(self):
+        import fileutil
+        # unlink files and symlinks first (type is known from the validation), then remove the remaining directory trees
+        dirs = set()
+        files = []
         for file in self.files:
-            if os.path.islink(file):
-                os.unlink(file)
-            elif os.path.isdir(file):
-                shutil.rmtree(file)
+            fileStat = _statOnce(file)
+            if fileStat.isDir and not fileStat.isLink:
+                dirs.add(file)
             else:
-                os.remove(file)
-        for file in self.logFiles:
-            os.remove(file)
+                files.append(file)
+        fileutil.bulkUnlink(files)
+        for dir in sorted(dirs):
+            # nested dirs are already removed with their parent
+            if os.path.exists(dir):
+                fileutil.fastRmtree(dir)
+        fileutil.bulkUnlink(self.logFiles)
+        # files have changed
+        _clearStatCache()
 
 def remove(args):
     """Removes an application."""
-    app = Application(args.name)
+    app = Application.get(args.name)
     remove = RemoveTask(app, args.desktopOnly, args.pathOnly, args.force)
 
-    app.printSummary()
-    remove.printSummary()
-    print()
-    doContinue = True if args.noPrompt or remove.empty else getYesOrNo('Do you want to continue?', False)
-    if doContinue:
-        remove.execute()
+    # nothing to delete: neither ask nor execute
+    _confirmAndExecute(args, [app, remove], [] if remove.empty else [remove], 'Do you want to continue?')
+
+def _iterApps():
+    """Yield all applications of OPT_DIR sorted by name (one scan, the DirEntry stat is reused)."""
+    # application dirs are symlinks to INSTALL_DIR, so follow them
+    with os.scandir(OPT_DIR) as it:
+        entries = sorted((e for e in it if e.is_dir() and e.path != INSTALL_DIR), key=lambda e: e.name)
+    # one scan of INSTALL_DIR (install dirs and log files) instead of stats per application
+    _statDir(INSTALL_DIR)
+    for entry in entries:
+        yield Application.fromEntry(entry)
 
 def listApps(args):
     """List applications."""
     if args.name is None:
-        # determine all dirs OPT_DIR
-        files = sorted(os.listdir(OPT_DIR))
-        if len(files) == 0:
-            # no applications installed
-            return
-        for file in files:
-            appDir = os.path.join(OPT_DIR, file)
-            if appDir == INSTALL_DIR:
-                continue
-            if os.path.isdir(appDir):
-                app = Application(file)
-                app.printShortSummary()
-            
+        sys.stdout.write(''.join(app.getShortSummary() + '\n' for app in _iterApps()))
+
     else:
-        app = Application(args.name)
+        app = Application.get(args.name)
         app.printSummary()
         app.printDetails()
 
@@ -454,34 +656,36 @@ class DesktopTask:
         _printList(f'Copy .png files to "{ICON_DIR}":', self.pngOps)
 
     def execute(self):
-        logFile = self.app.getLogFile(CMD_DESKTOP)
-        with open(logFile, 'a') as log:
-            for op in self.desktopOps:
-                shutil.copyfile(op.src, op.dst)
-                fileutil.chmod_add(op.dst, stat.S_IEXEC | stat.S_IREAD)
-                log.write(f'{op.dst}\n')
-            for op in self.pngOps:
-                shutil.copyfile(op.src, op.dst)
-                fileutil.chmod_add(op.dst, stat.S_IREAD)
-                log.write(f'{op.dst}\n')
+        logFile = _openLog(self.app.getLogFile(CMD_DESKTOP))
+        import fileutil
+        # target dirs are opened once, files are created relative to them
+        dirFds = {}
+        try:
+            copies = {}
+            for ops, targetDir, mode in [(self.desktopOps, DESKTOP_DIR, stat.S_IEXEC | stat.S_IREAD), (self.pngOps, ICON_DIR, stat.S_IREAD)]:
+                if ops:
+                    dirFd = dirFds[targetDir] = os.open(targetDir, os.O_RDONLY | os.O_DIRECTORY)
+                    # of files with the same destination the last one wins
+                    copies.update({op.dst: (op.src, os.path.basename(op.dst), dirFd, mode) for op in ops})
+            # independent files: copy in parallel
+            fileutil.runParallel(fileutil.fastCopyFile, list(copies.values()))
+        finally:
+            for dirFd in dirFds.values():
+                os.close(dirFd)
+        for op in self.desktopOps + self.pngOps:
+            op.invalidate()
+            _writeLog(logFile, op.dst)
 
 def desktop(args):
     """Install menu entries (*.desktop)."""
     # see: https://help.ubuntu.com/community/UnityLaunchersAndDesktopFiles
     # see: https://developer.gnome.org/integration-guide/stable/desktop-files.html.en
     # see: https://specifications.freedesktop.org/desktop-entry-spec/latest/index.html
-    existing, nonExisting = _validateFiles(args.file)
-    if nonExisting:
-        raise OptError('File(s) do not exist:', nonExisting)
-    app = Application(args.name)
+    existing = _existingFiles(args.file)
+    app = Application.get(args.name)
     desktop = DesktopTask(app, existing)
 
-    app.printSummary()
-    desktop.printSummary()
-    print()
-    doContinue = True if args.noPrompt or not desktop.overwrite else getYesOrNo('Overwrite existing files marked with prefix "!"?', False)
-    if doContinue:
-        desktop.execute()
+    _confirmAndExecute(args, [app, desktop], [desktop], _OVERWRITE_QUESTION, needsPrompt=desktop.overwrite)
 
 class AutoCompleteTask:
     def __init__(self, app, files):
@@ -498,26 +702,20 @@ class AutoCompleteTask:
         # ensure target dir is created
         os.makedirs(AUTOCOMPLETE_DIR, exist_ok=True)
         
-        logFile = self.app.getLogFile(CMD_AUTOCOMPLETE)
-        with open(logFile, 'a') as log:
-            shutil.copyfile(self.op.src, self.op.dst)
-            log.write(f'{self.op.dst}\n')
+        logFile = _openLog(self.app.getLogFile(CMD_AUTOCOMPLETE))
+        import fileutil
+        fileutil.fastCopyFile(self.op.src, self.op.dst)
+        self.op.invalidate()
+        _writeLog(logFile, self.op.dst)
     
 def autocomplete(args):
     """Install auto completion script."""
     # see: https://www.baeldung.com/linux/shell-auto-completion
-    existing, nonExisting = _validateFiles([args.file])
-    if nonExisting:
-        raise OptError('File(s) do not exist:', nonExisting)
-    app = Application(args.name)
-    autocomplete = AutoCompleteTask(app, existing)
+    existing = _existingFile(args.file)
+    app = Application.get(args.name)
+    autocomplete = AutoCompleteTask(app, [existing])
 
-    app.printSummary()
-    autocomplete.printSummary()
-    print()
-    doContinue = True if args.noPrompt or not autocomplete.overwrite else getYesOrNo('Overwrite existing files marked with prefix "!"?', False)
-    if doContinue:
-        autocomplete.execute()
+    _confirmAndExecute(args, [app, autocomplete], [autocomplete], _OVERWRITE_QUESTION, needsPrompt=autocomplete.overwrite)
 
 class AliasTask:
     def __init__(self, aliasApp, targetApp):
@@ -539,50 +737,85 @@ class AliasTask:
         _printList(f'Create alias "{self.aliasApp.name}" for application "{self.targetApp.name}"', []) 
         
     def execute(self):
-        logFile = self.aliasApp.getLogFile(CMD_ALIAS)
-        with open(logFile, 'a') as log:
-            # clean application folder with old data
-            if os.path.islink(self.aliasApp.appInstallDir):
-                os.unlink(self.aliasApp.appInstallDir) 
-            # create alias symlink to target
-            os.symlink(self.targetApp.appDir, self.aliasApp.appInstallDir, target_is_directory=True)
-            log.write(f'{self.aliasApp.appInstallDir}\n')
-            if not os.path.exists(self.aliasApp.appDir):
-                os.symlink(self.aliasApp.appInstallDir, self.aliasApp.appDir, target_is_directory=True)
-                log.write(f'{self.aliasApp.appDir}\n')
+        logFile = _openLog(self.aliasApp.getLogFile(CMD_ALIAS))
+        import fileutil
+        # create alias symlink to target (replaces the link to the old target)
+        fileutil.atomicSymlink(self.targetApp.appDir, self.aliasApp.appInstallDir, target_is_directory=True)
+        _writeLog(logFile, self.aliasApp.appInstallDir)
+        if not self.aliasApp.appDirStat.exists and not self.aliasApp.appDirStat.isLink:
+            os.symlink(self.aliasApp.appInstallDir, self.aliasApp.appDir, target_is_directory=True)
+            _writeLog(logFile, self.aliasApp.appDir)
 
 def alias(args):
     """Create an alias for an application."""
-    targetApp = Application(args.target)
-    aliasApp = Application(args.name)
+    targetApp = Application.get(args.target)
+    aliasApp = Application.get(args.name)
     alias = AliasTask(aliasApp, targetApp)
     
-    aliasApp.printSummary()
-    alias.printSummary()
-    print()
-    doContinue = True if args.noPrompt or not alias.overwrite else getYesOrNo('Overwrite exiting application?', False)
-    if doContinue:
-        alias.execute()
+    _confirmAndExecute(args, [aliasApp, alias], [alias], 'Overwrite exiting application?', needsPrompt=alias.overwrite)
+
+def _existingFiles(files):
+    """Pre-flight check of the command files: return them as absolute paths without duplicates or raise OptError."""
+    existing, nonExisting = _validateFiles(files)
+    if nonExisting:
+        raise OptError('File(s) do not exist:', nonExisting)
+    return existing
+
+def _existingFile(file):
+    """Pre-flight check of a single command file: return its absolute path or raise OptError."""
+    existing, nonExisting = _validateOne(file)
+    if nonExisting:
+        raise OptError('File(s) do not exist:', [nonExisting])
+    return existing
+
+def _validateOne(file, brokenLinks=False):
+    """Check if a single file exists and convert it to an absolute path: (file, None) or (None, file)."""
+    file = os.path.abspath(file)
+    found = _lexists(file) if brokenLinks else _exists(file)
+    return (file, None) if found else (None, file)
 
 def _validateFiles(files, brokenLinks=False):
     """Check if files exist, convert to absolute paths and remove duplicates."""
     existing = []
     nonExisting = []
+    # os.path.exists returns false for broken links, lexists covers both cases
+    existsFn = _lexists if brokenLinks else _exists
+    byParent = defaultdict(set)
     for file in set(files):
-        if os.path.exists(file):
-            existing.append(os.path.abspath(file))
-        elif brokenLinks and os.path.islink(file):
-            # os.path.exists returns false for broken links
-            existing.append(os.path.abspath(file))
-        else:
-            nonExisting.append(os.path.abspath(file))
+        file = os.path.abspath(file)
+        byParent[os.path.dirname(file)].add(file)
+    for parent, group in byParent.items():
+        entries = None
+        if len(group) > 1:
+            # one directory scan for all files of the same parent
+            try:
+                with os.scandir(parent) as it:
+                    entries = {e.name: e for e in it}
+            except OSError:
+                pass
+        for file in group:
+            name = os.path.basename(file)
+            if entries is None or not name:
+                found = existsFn(file)
+            else:
+                # remember the result (also for missing files) for later checks of this command
+                entry = entries.get(name)
+                if entry is None:
+                    _statCache[file] = FileStat(False, False, False)
+                    found = False
+                else:
+                    fileStat = _statEntry(entry)
+                    found = brokenLinks or fileStat.exists
+            (existing if found else nonExisting).append(file)
     return existing, nonExisting
     
 def _printList(msg, list, fn=lambda i: i):
     """Print a message and a list of items."""
-    print(msg)
-    for i in list:
-        print(f'   {fn(i)}')
+    # one write for all lines
+    lines = [msg]
+    lines.extend(f'   {fn(i)}' for i in list)
+    lines.append('')
+    sys.stdout.write('\n'.join(lines))
 
 def getYesOrNo(question, default=True):
     valid = {"yes": True, "y": True, "ye": True, "no": False, "n": False}
@@ -596,10 +829,23 @@ def getYesOrNo(question, default=True):
             return valid[choice]
         else:
             print('Please respond with "yes" or "no" (or "y" or "n").')
-            
-def main(argv=None, rootRequired=False):
-    try:
-        PROG_DESC = """\
+
+_OVERWRITE_QUESTION = 'Overwrite existing files marked with prefix "!"?'
+
+def _confirmAndExecute(args, summaries, tasks, question, default=False, needsPrompt=True):
+    """Print all summaries, ask once (only if needed) and execute the tasks."""
+    for summary in summaries:
+        summary.printSummary()
+    print()
+    # no tasks -> nothing to confirm
+    needsPrompt = needsPrompt and bool(tasks) and not args.noPrompt
+    if needsPrompt and not getYesOrNo(question, default):
+        return
+    for task in tasks:
+        task.execute()
+
+# program description (shown by --help only)
+PROG_DESC = """\
             Opt.py is an installation manager for the /opt directory. The /opt directory is reserved for all the software and add-on packages that are not part of the default installation. 
             
             If a program does not provide an installation file for the package manager used (e.g. APT), the program can be installed in /opt. However, this installation can be tedious: 
@@ -667,78 +913,235 @@ def main(argv=None, rootRequired=False):
             /opt/.installer/application.alias
             
             """
-        
-        parser = argparse.ArgumentParser(description=dedent(PROG_DESC), formatter_class=argparse.RawTextHelpFormatter)
-        parser.add_argument('--debug', help="activate DEBUG logging", action="store_true")
-        parser.add_argument('-y', '--yes', action="store_true", dest="noPrompt", help="answer all questions with yes")
-
-        subparsers = parser.add_subparsers(dest='command')
-        # install
-        installParser = subparsers.add_parser(CMD_INSTALL, help='install a new application', description='Installs a new application')
-        installParser.add_argument('--no-path', default=False, dest='noPath', action='store_true', help='do not add application to $PATH automatically')
-        installParser.add_argument('name', help='application name')
-        installParser.add_argument('file', nargs='+', help='file to install')
-        # update
-        updateParser = subparsers.add_parser(CMD_UPDATE, help='update application', description='Replace the application data by the given file(s). By default, all existing application files remain in place. You can use "--delete" to delete all application files and "--keep" to keep individual files (e.g. for settings).')
-        updateParser.add_argument('--delete', dest='delete', action='store_true', help='delete all files before updating')
-        updateParser.add_argument('--keep', dest='keep', action='append', help='keep a file or folder')
-        updateParser.add_argument('name', help='application name')
-        updateParser.add_argument('file', nargs='+', help='file to install')
-        # remove
-        removeParser = subparsers.add_parser(CMD_REMOVE, help="remove application/alias", description="Removes an application or alias")
-        removeParser.add_argument('-f', '--force', action="store_true", dest="force", help="force to remove all files and folders")
-        removeParser.add_argument('--path-only', action="store_true", dest="pathOnly", help="remove path symlinks only")
-        removeParser.add_argument('--desktop-only', action="store_true", dest="desktopOnly", help="remove menu entries in desktop only")
-        removeParser.add_argument('name', help='application name or alias')
-        # desktop 
-        menuParser = subparsers.add_parser(CMD_DESKTOP, help="create menu entry according to freedesktop.org specifications", description="Create a menu entry by using a .desktop file")
-        menuParser.add_argument("name", help="application name")
-        menuParser.add_argument("file", nargs="+", help="*.desktop/*.png file")
-        # autocomplete
-        autoParser = subparsers.add_parser(CMD_AUTOCOMPLETE, help="copy shell auto completion script to the right place", description="Add support for shell auto completion")
-        autoParser.add_argument("name", help="application name")
-        autoParser.add_argument("file", help="auto completion script")
-        # path
-        pathParser = subparsers.add_parser(CMD_PATH, help="add application to $PATH", description=f'Add application to $PATH by creating a symlink in "{BIN_DIR}"')
-        pathParser.add_argument("--link-name", dest='linkName', help='link name in $PATH')
-        pathParser.add_argument("name", help="application name")
-        pathParser.add_argument("file", help=f'executable target file, e.g. {OPT_DIR}/<name>/yourapp')
-        # list
-        listParser = subparsers.add_parser(CMD_LIST, help="list installed applications", description="List all installed applications or all files belonging to one application")
-        listParser.add_argument("name", nargs="?", help="application name")
-        # alias
-        aliasParser = subparsers.add_parser(CMD_ALIAS, help="create an alias for an installed application", description="Create an alias for an installed application")
-        aliasParser.add_argument("name", help="application alias")
-        aliasParser.add_argument("target", help="target application name (must already be installed)")
-
-        args = parser.parse_args(argv)
+
+# help texts depending on the target dirs are formatted only once
+_PATH_DESC = f'Add application to $PATH by creating a symlink in "{BIN_DIR}"'
+_PATH_FILE_HELP = f'executable target file, e.g. {OPT_DIR}/<name>/yourapp'
+
+@lru_cache(maxsize=None)
+def _nameParent():
+    """Parent parser with the application name argument shared by most commands."""
+    parent = argparse.ArgumentParser(add_help=False)
+    parent.add_argument('name', help='application name')
+    return parent
+
+@lru_cache(maxsize=None)
+def _installParent():
+    """Parent parser with the arguments shared by install and update."""
+    parent = argparse.ArgumentParser(add_help=False, parents=[_nameParent()])
+    parent.add_argument('file', nargs='+', help='file to install')
+    return parent
+
+def _buildInstallParser(subparsers, describe):
+    installParser = subparsers.add_parser(CMD_INSTALL, help='install a new application', description=describe('Installs a new application'), parents=[_installParent()])
+    installParser.add_argument('--no-path', default=False, dest='noPath', action='store_true', help='do not add application to $PATH automatically')
+
+def _buildUpdateParser(subparsers, describe):
+    updateParser = subparsers.add_parser(CMD_UPDATE, help='update application', description=describe('Replace the application data by the given file(s). By default, all existing application files remain in place. You can use "--delete" to delete all application files and "--keep" to keep individual files (e.g. for settings).'), parents=[_installParent()])
+    updateParser.add_argument('--delete', dest='delete', action='store_true', help='delete all files before updating')
+    updateParser.add_argument('--keep', dest='keep', action='append', help='keep a file or folder')
+
+def _buildRemoveParser(subparsers, describe):
+    removeParser = subparsers.add_parser(CMD_REMOVE, help="remove application/alias", description=describe("Removes an application or alias"))
+    removeParser.add_argument('-f', '--force', action="store_true", dest="force", help="force to remove all files and folders")
+    removeParser.add_argument('--path-only', action="store_true", dest="pathOnly", help="remove path symlinks only")
+    removeParser.add_argument('--desktop-only', action="store_true", dest="desktopOnly", help="remove menu entries in desktop only")
+    removeParser.add_argument('name', help='application name or alias')
+
+def _buildDesktopParser(subparsers, describe):
+    menuParser = subparsers.add_parser(CMD_DESKTOP, help="create menu entry according to freedesktop.org specifications", description=describe("Create a menu entry by using a .desktop file"), parents=[_nameParent()])
+    menuParser.add_argument("file", nargs="+", help="*.desktop/*.png file")
+
+def _buildAutoCompleteParser(subparsers, describe):
+    autoParser = subparsers.add_parser(CMD_AUTOCOMPLETE, help="copy shell auto completion script to the right place", description=describe("Add support for shell auto completion"), parents=[_nameParent()])
+    autoParser.add_argument("file", help="auto completion script")
+
+def _buildPathParser(subparsers, describe):
+    pathParser = subparsers.add_parser(CMD_PATH, help="add application to $PATH", description=describe(_PATH_DESC), parents=[_nameParent()])
+    pathParser.add_argument("--link-name", dest='linkName', help='link name in $PATH')
+    pathParser.add_argument("file", help=_PATH_FILE_HELP)
+
+def _buildListParser(subparsers, describe):
+    listParser = subparsers.add_parser(CMD_LIST, help="list installed applications", description=describe("List all installed applications or all files belonging to one application"))
+    listParser.add_argument("name", nargs="?", help="application name")
+
+def _buildAliasParser(subparsers, describe):
+    aliasParser = subparsers.add_parser(CMD_ALIAS, help="create an alias for an installed application", description=describe("Create an alias for an installed application"))
+    aliasParser.add_argument("name", help="application alias")
+    aliasParser.add_argument("target", help="target application name (must already be installed)")
+
+# command -> function adding its subparser (in help order)
+_PARSER_BUILDERS = {
+    CMD_INSTALL: _buildInstallParser,
+    CMD_UPDATE: _buildUpdateParser,
+    CMD_REMOVE: _buildRemoveParser,
+    CMD_DESKTOP: _buildDesktopParser,
+    CMD_AUTOCOMPLETE: _buildAutoCompleteParser,
+    CMD_PATH: _buildPathParser,
+    CMD_LIST: _buildListParser,
+    CMD_ALIAS: _buildAliasParser,
+}
+
+@lru_cache(maxsize=None)
+def _getParser(command, helpRequested):
+    """Return the parser for command (None: all commands), built once per process (parse_args does not change it)."""
+    # descriptions are only shown by --help
+    describe = (lambda text: text) if helpRequested else (lambda text: None)
+    description = None
+    if helpRequested:
+        from textwrap import dedent
+        description = dedent(PROG_DESC)
+    parser = argparse.ArgumentParser(description=description, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--debug', help="activate DEBUG logging", action="store_true")
+    parser.add_argument('-y', '--yes', action="store_true", dest="noPrompt", help="answer all questions with yes")
+
+    subparsers = parser.add_subparsers(dest='command')
+    if command is not None:
+        _PARSER_BUILDERS[command](subparsers, describe)
+    else:
+        for buildParser in _PARSER_BUILDERS.values():
+            buildParser(subparsers, describe)
+    return parser
+
+def _parseArgs(argv):
+    """Parse the command line with argparse."""
+    helpRequested = any(a in ('-h', '--help') for a in argv)
+    # only one command runs: build its parser only (all parsers for help, errors and the default command)
+    command = next((a for a in argv if not a.startswith('-')), None)
+    if helpRequested or command not in _PARSER_BUILDERS:
+        command = None
+    return _getParser(command, helpRequested).parse_args(argv)
+
+# command -> (flags: option -> dest, options with value: option -> (dest, append), positionals: [(dest, nargs)])
+_FAST_SCHEMA = {
+    CMD_INSTALL: ({'--no-path': 'noPath'}, {}, [('name', None), ('file', '+')]),
+    CMD_UPDATE: ({'--delete': 'delete'}, {'--keep': ('keep', True)}, [('name', None), ('file', '+')]),
+    CMD_REMOVE: ({'-f': 'force', '--force': 'force', '--path-only': 'pathOnly', '--desktop-only': 'desktopOnly'}, {}, [('name', None)]),
+    CMD_DESKTOP: ({}, {}, [('name', None), ('file', '+')]),
+    CMD_AUTOCOMPLETE: ({}, {}, [('name', None), ('file', None)]),
+    CMD_PATH: ({}, {'--link-name': ('linkName', False)}, [('name', None), ('file', None)]),
+    CMD_LIST: ({}, {}, [('name', '?')]),
+    CMD_ALIAS: ({}, {}, [('name', None), ('target', None)]),
+}
+
+def _fastParse(argv):
+    """Parse a common command line like argparse would. Return None for everything else (help, errors, abbreviations, ...)."""
+    args = argparse.Namespace(debug=False, noPrompt=False)
+    i = 0
+    # global options
+    while i < len(argv) and argv[i].startswith('-'):
+        if argv[i] == '--debug':
+            args.debug = True
+        elif argv[i] in ('-y', '--yes'):
+            args.noPrompt = True
+        else:
+            return None
+        i += 1
+    if i == len(argv) or argv[i] not in _FAST_SCHEMA:
+        return None
+    args.command = argv[i]
+    flags, valueOptions, positionals = _FAST_SCHEMA[args.command]
+    for dest in flags.values():
+        setattr(args, dest, False)
+    for dest, append in valueOptions.values():
+        setattr(args, dest, None)
+    values = []
+    i += 1
+    while i < len(argv):
+        arg = argv[i]
+        i += 1
+        if not arg.startswith('-') or arg == '-':
+            values.append(arg)
+            continue
+        option, sep, value = arg.partition('=')
+        # options after positionals are left to argparse
+        if values:
+            return None
+        if option in flags and not sep:
+            setattr(args, flags[option], True)
+        elif option in valueOptions:
+            if not sep:
+                if i == len(argv) or argv[i].startswith('-'):
+                    return None
+                value = argv[i]
+                i += 1
+            dest, append = valueOptions[option]
+            if append:
+                value = (getattr(args, dest) or []) + [value]
+            setattr(args, dest, value)
+        else:
+            return None
+    # assign positionals, only the last one may be optional or take several values
+    for dest, nargs in positionals:
+        if nargs == '+':
+            if not values:
+                return None
+            setattr(args, dest, values)
+            values = []
+        elif nargs == '?':
+            setattr(args, dest, values.pop(0) if values else None)
+        else:
+            if not values:
+                return None
+            setattr(args, dest, values.pop(0))
+    return args if not values else None
+
+# command -> function executing it
+_DISPATCH = {
+    CMD_INSTALL: lambda args: installOrUpdate(args, False),
+    CMD_UPDATE: lambda args: installOrUpdate(args, True),
+    CMD_REMOVE: remove,
+    CMD_PATH: path,
+    CMD_DESKTOP: desktop,
+    CMD_AUTOCOMPLETE: autocomplete,
+    CMD_LIST: listApps,
+    CMD_ALIAS: alias,
+}
+
+def runCommand(command, debug=False, noPrompt=False, **options):
+    """Run a command without a command line, options as parsed by argparse: runCommand(CMD_INSTALL, name='app', file=['app.tar'])."""
+    args = argparse.Namespace(command=command, debug=debug, noPrompt=noPrompt)
+    flags, valueOptions, positionals = _FAST_SCHEMA[command]
+    for dest in flags.values():
+        setattr(args, dest, False)
+    for dest, append in valueOptions.values():
+        setattr(args, dest, None)
+    for dest, nargs in positionals:
+        if nargs != '?' and dest not in options:
+            raise TypeError(f'Command "{command}" requires argument "{dest}"')
+        setattr(args, dest, None)
+    for dest, value in options.items():
+        if not hasattr(args, dest):
+            raise TypeError(f'Command "{command}" has no argument "{dest}"')
+        setattr(args, dest, value)
+    _run(args)
+
+def _run(args, rootRequired=False):
+    """Execute the parsed command."""
+    try:
+        _clearStatCache()
         # init logging
-        level = logging.DEBUG if args.debug else logging.WARNING
-        logging.basicConfig(format='%(levelname)s: %(message)s', level=level, force=True)
+        if args.debug:
+            logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.DEBUG, force=True)
+        else:
+            # only debug messages are logged, so no handler is needed
+            logging.root.setLevel(logging.WARNING)
         
-        if rootRequired and os.geteuid() != 0:
-            raise OptError('Root privileges required')
         if args.command is None:
             # if no command is specified, print application list
             args.command = CMD_LIST
             args.name = None
+        else:
+            # same object as the CMD_ constant (compile time interned), lookups compare by identity
+            args.command = sys.intern(args.command)
+        if rootRequired and args.command in _ROOT_CMDS and not _isRoot():
+            raise OptError('Root privileges required')
 
-        if args.command == CMD_INSTALL:
-            installOrUpdate(args, False)
-        elif args.command == CMD_UPDATE:
-            installOrUpdate(args, True)
-        elif args.command == CMD_REMOVE:
-            remove(args)
-        elif args.command == CMD_PATH:
-            path(args)
-        elif args.command == CMD_DESKTOP:
-            desktop(args)
-        elif args.command == CMD_AUTOCOMPLETE:
-            autocomplete(args)
-        elif args.command == CMD_LIST:
-            listApps(args)
-        elif args.command == CMD_ALIAS:
-            alias(args)
+        try:
+            _DISPATCH[args.command](args)
+        finally:
+            # also the entries of a failed command (errors of the log files are handled below)
+            _flushLogs()
 
     except OptError as e:
         _printList(e.msg, e.items)
@@ -747,8 +1150,18 @@ def main(argv=None, rootRequired=False):
         print(e)
         logging.debug(type(e))
         if args.debug:
+            import traceback
             traceback.print_exc()
 
+def main(argv=None, rootRequired=False):
+    if argv is None:
+        argv = sys.argv[1:]
+    # common command lines are parsed without building the argparse parsers
+    args = _fastParse(argv)
+    if args is None:
+        args = _parseArgs(argv)
+    _run(args, rootRequired)
+
 if __name__ == '__main__':
     main(rootRequired=True)
 
@@ -1,17 +1,48 @@
 #!/usr/bin/env python3
 
 import unittest
+import bz2
+import io
+import lzma
 import os
+import queue
 import sys
 import shutil
+import stat
+import tarfile
+import tempfile
+import threading
+import time
+import types
+from concurrent.futures import ProcessPoolExecutor
 #from pathlib import Path
 
 # import from parent dir
 PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, os.path.dirname(PROJECT_DIR))
 import opt
+import fileutil
 APP_NAME = 'app-v1'
+# OPT_TEST_DEBUG=1: show test output and debug logging of opt.py
+DEBUG = bool(os.environ.get('OPT_TEST_DEBUG'))
+DEBUG_ARGS = ['--debug'] if DEBUG else []
 ROOT_DIR = os.path.join(PROJECT_DIR, 'root')
+# temporary files in RAM if possible
+TMP_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+RESOURCES_DIR = os.path.join(PROJECT_DIR, 'resources')
+# resource files (joined once)
+RES = types.SimpleNamespace(
+    folder=RESOURCES_DIR,
+    tar=os.path.join(RESOURCES_DIR, 'test_file.tar'),
+    tarBz2=os.path.join(RESOURCES_DIR, 'test_file.tar.bz2'),
+    tarGz=os.path.join(RESOURCES_DIR, 'test_file.tar.gz'),
+    tarXz=os.path.join(RESOURCES_DIR, 'test_file.tar.xz'),
+    zip=os.path.join(RESOURCES_DIR, 'test_file.zip'),
+    file1=os.path.join(RESOURCES_DIR, 'test_file1.txt'),
+    file2=os.path.join(RESOURCES_DIR, 'test_file2.txt'),
+    file3=os.path.join(RESOURCES_DIR, 'test_file3.txt'),
+    zipFolder=os.path.join(RESOURCES_DIR, 'test_folder1_test_file1.zip'),
+)
 
 # Usage:
 # > test_opt.py
@@ -21,213 +52,325 @@ ROOT_DIR = os.path.join(PROJECT_DIR, 'root')
 # set owner wenn nötig
 
 class TestOpt(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # test roots are removed in the background while the next test runs
+        cls.deleteQueue = queue.Queue()
+        cls.deleteThread = threading.Thread(target=lambda: [shutil.rmtree(d, ignore_errors=True) for d in iter(cls.deleteQueue.get, None)], daemon=True)
+        cls.deleteThread.start()
+        # resource copies with fixed permissions (set once, resources stay untouched): rw/<file> and rwx/<file>
+        cls.fixtures = tempfile.mkdtemp(prefix='opt-fixtures-', dir=TMP_DIR)
+        # resources are read from RAM (self.RES) and the tar archive is extracted once (tarDir)
+        resources = os.path.join(cls.fixtures, 'resources')
+        shutil.copytree(RESOURCES_DIR, resources)
+        cls.RES = types.SimpleNamespace(**{k: os.path.normpath(os.path.join(resources, os.path.relpath(v, RESOURCES_DIR))) for k, v in vars(RES).items()})
+        cls.RES.tarDir = os.path.join(cls.fixtures, 'tar')
+        with tarfile.open(cls.RES.tar) as tar:
+            tar.extractall(cls.RES.tarDir, **({'filter': 'data'} if hasattr(tarfile, 'data_filter') else {}))
+        for dirName, mode in (('rw', 0o666), ('rwx', 0o777)):
+            os.mkdir(os.path.join(cls.fixtures, dirName))
+            for name in ('exec-app.bin', 'exec.xml', 'test_file1.txt'):
+                file = os.path.join(cls.fixtures, dirName, name)
+                shutil.copyfile(os.path.join(RESOURCES_DIR, name), file)
+                os.chmod(file, mode)
+        cls.execFileRW = os.path.join(cls.fixtures, 'rw', 'exec-app.bin')
+        cls.execFileRWX = os.path.join(cls.fixtures, 'rwx', 'exec-app.bin')
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.fixtures, ignore_errors=True)
+        # wait for the pending deletions
+        cls.deleteQueue.put(None)
+        cls.deleteThread.join()
+
     def setUp(self):
-        os.makedirs(ROOT_DIR, exist_ok=True)
-        shutil.rmtree(ROOT_DIR)
+        # fresh root per test, in RAM if possible (no stale state to clean up)
+        self.root = tempfile.mkdtemp(prefix='opt-', dir=TMP_DIR)
         
-        opt.OPT_DIR = os.path.abspath(os.path.join(ROOT_DIR, 'opt'))
-        opt.BIN_DIR = os.path.abspath(os.path.join(ROOT_DIR, 'usr-local-bin'))
-        opt.DESKTOP_DIR = os.path.join(ROOT_DIR, 'usr-share-applications')
-        opt.AUTOCOMPLETE_DIR = os.path.join(ROOT_DIR, 'etc-bash_completion.d')
-        opt.ICON_DIR = os.path.join(ROOT_DIR, 'usr-share-piximage')
+        opt.OPT_DIR = os.path.join(self.root, 'opt')
+        opt.BIN_DIR = os.path.join(self.root, 'usr-local-bin')
+        opt.DESKTOP_DIR = os.path.join(self.root, 'usr-share-applications')
+        opt.AUTOCOMPLETE_DIR = os.path.join(self.root, 'etc-bash_completion.d')
+        opt.ICON_DIR = os.path.join(self.root, 'usr-share-piximage')
         opt.INSTALL_DIR = os.path.join(opt.OPT_DIR, '.installer')
-        os.makedirs(opt.OPT_DIR, exist_ok=True)
-        os.makedirs(opt.BIN_DIR, exist_ok=True)
-        os.makedirs(opt.DESKTOP_DIR, exist_ok=True)
-        os.makedirs(opt.ICON_DIR, exist_ok=True)
+        # no state of the previous test (applications, stats)
+        opt._clearStatCache()
+        # the root is new and empty: one mkdir per leaf, no recursion or exists checks
+        for d in (opt.OPT_DIR, opt.BIN_DIR, opt.DESKTOP_DIR, opt.AUTOCOMPLETE_DIR, opt.ICON_DIR):
+            os.mkdir(d)
+        # output of the tests and opt.py goes to memory
+        self.stdout = sys.stdout
+        if not DEBUG:
+            sys.stdout = io.StringIO()
     
     def tearDown(self):
-        #shutil.rmtree(ROOT_DIR)
-        pass
-
-    def test_install_tar(self):
-        print('+++++++++++ test_install_tar ++++++++++')
-        self._installOrUpdate(APP_NAME, os.path.join(PROJECT_DIR, 'resources/test_file.tar'), ['test_file1.txt', 'test_file2.txt'])
-    def test_install_zip(self):
-        print('+++++++++++ test_install_zip ++++++++++')
-        self._installOrUpdate(APP_NAME, os.path.join(PROJECT_DIR, 'resources/test_file.zip'), ['test_file1.txt', 'test_file2.txt'])
-    def test_install_tar_bz2(self):
-        print('+++++++++++ test_install_tar_bz2 ++++++++++')
-        self._installOrUpdate(APP_NAME, os.path.join(PROJECT_DIR, 'resources/test_file.tar.bz2'), ['test_file1.txt', 'test_file2.txt'])
-    def test_install_tar_gz(self):
-        print('+++++++++++ test_install_tar_gz ++++++++++')
-        self._installOrUpdate(APP_NAME, os.path.join(PROJECT_DIR, 'resources/test_file.tar.gz'), ['test_file1.txt', 'test_file2.txt'])
-    def test_install_tar_xz(self):
-        print('+++++++++++ test_install_tar_xz ++++++++++')
-        self._installOrUpdate(APP_NAME, os.path.join(PROJECT_DIR, 'resources/test_file.tar.xz'), ['test_file1.txt', 'test_file2.txt'])
-    def test_install_zip_with_folder(self):
-        print('+++++++++++ test_install_zip_with_folder ++++++++++')
-        self._installOrUpdate(APP_NAME, os.path.join(PROJECT_DIR, 'resources/test_folder1_test_file1.zip'), ['test_file1.txt'], skipFolder='folder1')
+        sys.stdout = self.stdout
+        # each test has its own root, no rename needed before it is deleted
+        self.deleteQueue.put(self.root)
+
+    # archive (self.RES attribute), expected files, skipped container folder
+    ARCHIVES = [
+        ('tar', ['test_file1.txt', 'test_file2.txt'], None),
+        ('zip', ['test_file1.txt', 'test_file2.txt'], None),
+        ('tarBz2', ['test_file1.txt', 'test_file2.txt'], None),
+        ('tarGz', ['test_file1.txt', 'test_file2.txt'], None),
+        ('tarXz', ['test_file1.txt', 'test_file2.txt'], None),
+        ('zipFolder', ['test_file1.txt'], 'folder1'),
+    ]
+    def test_install_archives(self):
+        print('+++++++++++ test_install_archives ++++++++++')
+        # one setUp/tearDown for all archive types
+        for archive, expectedFiles, skipFolder in self.ARCHIVES:
+            with self.subTest(archive=archive):
+                print(f'+++++ {archive}')
+                self._resetApp(APP_NAME)
+                self._install(APP_NAME, getattr(self.RES, archive), expectedFiles, skipFolder=skipFolder)
+    def test_install_padded_archives(self):
+        """Record padding after the end-of-archive marker (tar -b 8192) is larger than a pipe buffer."""
+        print('+++++++++++ test_install_padded_archives ++++++++++')
+        with open(self.RES.tar, 'rb') as f:
+            data = f.read() + bytes(4 * 1024 * 1024)
+        for suffix, compress in (('.tar.xz', lzma.compress), ('.tar.bz2', bz2.compress)):
+            with self.subTest(archive=suffix):
+                archive = f'{self.root}{os.sep}padded{suffix}'
+                with open(archive, 'wb') as f:
+                    f.write(compress(data))
+                self._resetApp(APP_NAME)
+                self._install(APP_NAME, archive, ['test_file1.txt', 'test_file2.txt'])
     def test_install_twice(self):
         print('++++++++++ test_install_twice ++++++++++')
-        self._installOrUpdate(APP_NAME, os.path.join(PROJECT_DIR, 'resources/test_file1.txt'), ['test_file1.txt'])
-        self._installOrUpdate(APP_NAME, os.path.join(PROJECT_DIR, 'resources/test_file2.txt'), ['test_file1.txt'])
+        self._install(APP_NAME, self.RES.file1, ['test_file1.txt'])
+        self._install(APP_NAME, self.RES.file2, ['test_file1.txt'])
     def test_install_wrong_file(self):
         print('++++++++++ test_install_wrong_file ++++++++++')
-        opt.main(['--debug', '-y', 'install', APP_NAME, 'resources/__not_exists1__.txt', 'resources/__not_exists2__.txt'])
+        files = ['resources/__not_exists1__.txt', 'resources/__not_exists2__.txt']
+        # the pre-flight check reports all missing files
+        with self.assertRaises(opt.OptError) as cm:
+            opt._existingFiles(files)
+        self.assertEqual(sorted(cm.exception.items), [os.path.abspath(f) for f in files])
+        # the command refuses to install
+        opt.main([*DEBUG_ARGS, '-y', 'install', APP_NAME, *files])
         self.assertFalse(os.path.exists(opt.INSTALL_DIR))
     def test_install_unmanaged(self):
         print('++++++++++ test_install_unmanaged ++++++++++')
-        os.makedirs(os.path.join(opt.OPT_DIR, APP_NAME), exist_ok=True)
-        opt.main(['--debug', '-y', 'install', APP_NAME, 'resources/test_file1.txt'])
+        os.mkdir(self._getAppDir(APP_NAME))
+        # refused when the task is created, before anything is installed
+        self.assertRaises(opt.OptError, opt.InstallTask, opt.Application.get(APP_NAME), [self.RES.file1], False, False, [])
+        # the command refuses to install
+        opt.main([*DEBUG_ARGS, '-y', 'install', APP_NAME, 'resources/test_file1.txt'])
         self.assertFalse(os.path.exists(opt.INSTALL_DIR))
+    def test_install_probe_cleanup(self):
+        print('++++++++++ test_install_probe_cleanup ++++++++++')
+        # the archive is extracted in the install dir to search an executable for $PATH
+        self._install(APP_NAME, self.RES.tar, ['test_file1.txt', 'test_file2.txt'])
+        self.assertFalse([e for e in os.listdir(opt.INSTALL_DIR) if e.startswith('.probe-')])
+        # also removed if the extraction fails
+        brokenArchive = f'{self.root}{os.sep}broken.tar.gz'
+        with open(brokenArchive, 'wb') as f:
+            f.write(b'no archive')
+        opt.main([*DEBUG_ARGS, '-y', 'install', 'app-v2', brokenArchive])
+        self.assertFalse([e for e in os.listdir(opt.INSTALL_DIR) if e.startswith('.probe-')])
+        self.assertFalse(os.path.exists(self._getInstallDir('app-v2')))
     def test_install_folder(self):
         print('++++++++++ test_install_folder ++++++++++')
-        self._installOrUpdate(APP_NAME, os.path.join(PROJECT_DIR, 'resources'), ['test_file1.txt', 'test_folder1_test_file1.zip'])
+        self._install(APP_NAME, self.RES.folder, ['test_file1.txt', 'test_folder1_test_file1.zip'])
     def test_install_path_noexec(self):
         print('++++++++++ test_install_path_noexec ++++++++++')
         if os.name == 'nt':
             print('skipped on Windows')
             return
-        execFile = os.path.join(PROJECT_DIR, 'resources/exec-app.bin')
-        nonExecFile = os.path.join(PROJECT_DIR, 'resources/exec.xml')
-        os.chmod(execFile, 0o666) # rw
-        os.chmod(nonExecFile, 0o666) # rw
-        opt.main(['--debug', '-y', 'install', APP_NAME, execFile, nonExecFile])
+        execFile = self.execFileRW
+        nonExecFile = self._fixture('rw', 'exec.xml')
+        opt.main([*DEBUG_ARGS, '-y', 'install', APP_NAME, execFile, nonExecFile])
         self.assertTrue(self._isDirEmpty(opt.BIN_DIR), msg='No executable file available')
     def test_install_path_exec(self):
         print('++++++++++ test_install_path_exec ++++++++++')
         if os.name == 'nt':
             print('skipped on Windows')
             return
-        execFile = os.path.join(PROJECT_DIR, 'resources/exec-app.bin')
-        nonExecFile = os.path.join(PROJECT_DIR, 'resources/exec.xml')
-        os.chmod(execFile, 0o777) # rwx
-        os.chmod(nonExecFile, 0o666) # rw
-        opt.main(['--debug', '-y', 'install', APP_NAME, execFile, nonExecFile])
+        execFile = self.execFileRWX
+        nonExecFile = self._fixture('rw', 'exec.xml')
+        opt.main([*DEBUG_ARGS, '-y', 'install', APP_NAME, execFile, nonExecFile])
         self.assertFalse(self._isDirEmpty(opt.BIN_DIR))
-        expectedFile = os.path.join(opt.BIN_DIR, 'exec-app.bin')
+        expectedFile = f'{opt.BIN_DIR}{os.sep}exec-app.bin'
         self.assertTrue(os.path.exists(expectedFile), msg=f'Only executable file allowed: {expectedFile}')
-        # reset permissions
-        os.chmod(execFile, 0o666) # rw
 
     def test_update(self):
         print('++++++++++ test_update ++++++++++')
-        self._installOrUpdate(APP_NAME, os.path.join(PROJECT_DIR, 'resources/test_file1.txt'), ['test_file1.txt'])
-        self._installOrUpdate(APP_NAME, os.path.join(PROJECT_DIR, 'resources/test_file2.txt'), ['test_file2.txt'], update=True)
+        self._install(APP_NAME, self.RES.file1, ['test_file1.txt'])
+        self._update(APP_NAME, self.RES.file2, ['test_file2.txt'])
     def test_update_overwrite(self):
         print('++++++++++ test_update_overwrite ++++++++++')
-        self._installOrUpdate(APP_NAME, os.path.join(PROJECT_DIR, 'resources/test_file.tar'), ['test_file1.txt', 'test_file2.txt'])
+        self._install(APP_NAME, self.RES.tarDir, ['test_file1.txt', 'test_file2.txt'])
         print('+++++ mod file')
-        expectedFile = os.path.join(self._getAppDir(APP_NAME), 'test_file1.txt')
+        expectedFile = f'{self._getAppDir(APP_NAME)}{os.sep}test_file1.txt'
         with open(expectedFile, 'w') as f:
             f.write('Config: 2')
         print('+++++ update')
-        opt.main(['--debug', '-y', 'update', APP_NAME, 'resources/test_file.tar'])
+        opt.main([*DEBUG_ARGS, '-y', 'update', APP_NAME, 'resources/test_file.tar'])
         self.assertTrue(os.path.getsize(expectedFile) == 0)
     def test_update_keep(self):
         print('++++++++++ test_update_keep ++++++++++')
-        self._installOrUpdate(APP_NAME, os.path.join(PROJECT_DIR, 'resources/test_file.tar'), ['test_file1.txt', 'test_file2.txt'])
+        self._install(APP_NAME, self.RES.tarDir, ['test_file1.txt', 'test_file2.txt'])
         print('+++++ mod file')
-        expectedFile = os.path.join(self._getAppDir(APP_NAME), 'test_file1.txt')
+        expectedFile = f'{self._getAppDir(APP_NAME)}{os.sep}test_file1.txt'
         with open(expectedFile, 'w') as f:
             f.write('Config: 2')
         print('+++++ update')
-        opt.main(['--debug', '-y', 'update', '--keep', expectedFile, APP_NAME, 'resources/test_file.tar'])
+        opt.main([*DEBUG_ARGS, '-y', 'update', '--keep', expectedFile, APP_NAME, 'resources/test_file.tar'])
         self.assertTrue(os.path.getsize(expectedFile) > 0)
     def test_update_delete_keep(self):
         print('++++++++++ test_update_delete_keep ++++++++++')
-        self._installOrUpdate(APP_NAME, os.path.join(PROJECT_DIR, 'resources/test_file.tar'), ['test_file1.txt', 'test_file2.txt'])
+        self._install(APP_NAME, self.RES.tarDir, ['test_file1.txt', 'test_file2.txt'])
         print('+++++ mod file')
-        expectedFile1 = os.path.join(self._getAppDir(APP_NAME), 'test_file1.txt')
-        expectedFile2 = os.path.join(self._getAppDir(APP_NAME), 'test_file2.txt')
-        expectedFile3 = os.path.join(self._getAppDir(APP_NAME), 'test_file3.txt')
+        expectedFile1 = f'{self._getAppDir(APP_NAME)}{os.sep}test_file1.txt'
+        expectedFile2 = f'{self._getAppDir(APP_NAME)}{os.sep}test_file2.txt'
+        expectedFile3 = f'{self._getAppDir(APP_NAME)}{os.sep}test_file3.txt'
         with open(expectedFile1, 'w') as f:
             f.write('Config: 2')
         print('+++++ update')
-        opt.main(['--debug', '-y', 'update', '--keep', expectedFile1, '--keep', expectedFile2, '--delete', APP_NAME, 'resources/test_file3.txt'])
+        opt.main([*DEBUG_ARGS, '-y', 'update', '--keep', expectedFile1, '--keep', expectedFile2, '--delete', APP_NAME, 'resources/test_file3.txt'])
         self.assertTrue(os.path.getsize(expectedFile1) > 0)
         self.assertTrue(os.path.exists(expectedFile1))
         self.assertTrue(os.path.exists(expectedFile2))
         self.assertTrue(os.path.exists(expectedFile3))
-        opt.main(['--debug', '-y', 'update', '--keep', expectedFile1, '--delete', APP_NAME, 'resources/test_file3.txt'])
+        opt.main([*DEBUG_ARGS, '-y', 'update', '--keep', expectedFile1, '--delete', APP_NAME, 'resources/test_file3.txt'])
         self.assertTrue(os.path.getsize(expectedFile1) > 0)
         self.assertTrue(os.path.exists(expectedFile1))
         self.assertFalse(os.path.exists(expectedFile2))
         self.assertTrue(os.path.exists(expectedFile3))
-        opt.main(['--debug', '-y', 'update', '--delete', APP_NAME, 'resources/test_file3.txt'])
+        opt.main([*DEBUG_ARGS, '-y', 'update', '--delete', APP_NAME, 'resources/test_file3.txt'])
         self.assertFalse(os.path.exists(expectedFile1))
         self.assertFalse(os.path.exists(expectedFile2))
         self.assertTrue(os.path.exists(expectedFile3))
     def test_update_nodelete_overwritefile(self):
         print('++++++++++ test_update_nodelete_overwritefile ++++++++++')
-        self._installOrUpdate(APP_NAME, os.path.join(PROJECT_DIR, 'resources/test_file.tar'), ['test_file1.txt', 'test_file2.txt'])
+        self._install(APP_NAME, self.RES.tarDir, ['test_file1.txt', 'test_file2.txt'])
         print('+++++ mod file')
-        expectedFile = os.path.join(self._getAppDir(APP_NAME), 'test_file1.txt')
+        expectedFile = f'{self._getAppDir(APP_NAME)}{os.sep}test_file1.txt'
         with open(expectedFile, 'w') as f:
             f.write('Config: 2')
         print('+++++ update and overwrite all files')
-        self._installOrUpdate(APP_NAME, os.path.join(PROJECT_DIR, 'resources/test_file.tar'), update=True, updateDelete=False)
+        self._update(APP_NAME, self.RES.tar, delete=False)
         self.assertTrue(os.path.getsize(expectedFile) == 0)
         print('+++++ mod file')
         with open(expectedFile, 'w') as f:
             f.write('Config: 2')
         print('+++++ update and overwrite only one file')
-        self._installOrUpdate(APP_NAME, os.path.join(PROJECT_DIR, 'resources/test_file2.txt'), update=True, updateDelete=False)
+        self._update(APP_NAME, self.RES.file2, delete=False)
         self.assertTrue(os.path.exists(expectedFile), msg=f'File still exists: {expectedFile}')
         self.assertTrue(os.path.getsize(expectedFile) > 0, msg=f'File still changed: {expectedFile}')
+    def test_update_nodelete_samefile(self):
+        print('++++++++++ test_update_nodelete_samefile ++++++++++')
+        self._install(APP_NAME, self.RES.file1, ['test_file1.txt'])
+        installedFile = f'{self._getAppDir(APP_NAME)}{os.sep}test_file1.txt'
+        with open(installedFile, 'w') as f:
+            f.write('content')
+        print('+++++ update')
+        # copying the installed file onto itself must not truncate it
+        opt.main([*DEBUG_ARGS, '-y', 'update', APP_NAME, installedFile])
+        with open(installedFile) as f:
+            self.assertEqual(f.read(), 'content')
+
     def test_update_nodelete_addfile(self):
         print('++++++++++ test_update_nodelete_addfile ++++++++++')
-        self._installOrUpdate(APP_NAME, os.path.join(PROJECT_DIR, 'resources/test_file.tar'), ['test_file1.txt', 'test_file2.txt'])
+        self._install(APP_NAME, self.RES.tarDir, ['test_file1.txt', 'test_file2.txt'])
         print('+++++ update')
-        self._installOrUpdate(APP_NAME, os.path.join(PROJECT_DIR, 'resources/test_file3.txt'), update=True, updateDelete=False)
+        self._update(APP_NAME, self.RES.file3, delete=False)
         for i in range(1,4):
-            expectedFile = os.path.join(self._getAppDir(APP_NAME), f'test_file{i}.txt')
+            expectedFile = f'{self._getAppDir(APP_NAME)}{os.sep}test_file{i}.txt'
             self.assertTrue(os.path.exists(expectedFile), msg=expectedFile)
    
     def test_list(self):
         print('++++++++++ test_list ++++++++++')
         APP_NAME_2 = 'app-v2'
-        self._installOrUpdate(APP_NAME, os.path.join(PROJECT_DIR, 'resources/test_file1.txt'))
-        self._installOrUpdate(APP_NAME_2, os.path.join(PROJECT_DIR, 'resources/test_file1.txt'))
-        self._installOrUpdate('audiosolutions-2.3.0', os.path.join(PROJECT_DIR, 'resources/test_file1.txt'))
+        self._install(APP_NAME, self.RES.file1)
+        self._install(APP_NAME_2, self.RES.file1)
+        self._install('audiosolutions-2.3.0', self.RES.file1)
         print('+++++ list')
-        opt.main(['--debug', '-y', 'list'])
+        opt.main([*DEBUG_ARGS, '-y', 'list'])
         print('+++++ list detail')
-        opt.main(['--debug', '-y', 'list', APP_NAME])
+        opt.main([*DEBUG_ARGS, '-y', 'list', APP_NAME])
     def test_list_update(self):
         print('++++++++++ test_list_update ++++++++++')
-        self._installOrUpdate(APP_NAME, os.path.join(PROJECT_DIR, 'resources/test_file1.txt'))
-        self._installOrUpdate(APP_NAME, os.path.join(PROJECT_DIR, 'resources/test_file2.txt'), ['test_file2.txt'], update=True)
-        self._installOrUpdate(APP_NAME, os.path.join(PROJECT_DIR, 'resources/test_file2.txt'), ['test_file2.txt'], update=True)
+        self._install(APP_NAME, self.RES.file1)
+        self._update(APP_NAME, self.RES.file2, ['test_file2.txt'])
+        self._update(APP_NAME, self.RES.file2, ['test_file2.txt'])
         print('+++++ list')
-        opt.main(['--debug', '-y', 'list'])
+        opt.main([*DEBUG_ARGS, '-y', 'list'])
         print('+++++ list detail')
-        opt.main(['--debug', '-y', 'list', APP_NAME])
+        opt.main([*DEBUG_ARGS, '-y', 'list', APP_NAME])
 
     def test_path(self):
         print('++++++++++ test_path ++++++++++')
-        self._installOrUpdate(APP_NAME, os.path.join(PROJECT_DIR, 'resources/test_file1.txt'))
-        os.chmod(os.path.join(self._getAppDir(APP_NAME), 'test_file1.txt'), 0o777) # rwx
+        # executable copy (no chmod), installed without the automatic path link
+        opt.runCommand(opt.CMD_INSTALL, debug=DEBUG, noPrompt=True, name=APP_NAME, file=[self._fixture('rwx', 'test_file1.txt')], noPath=True)
+        self._assertInstalled(APP_NAME, ['test_file1.txt'])
+        self.assertTrue(self._isDirEmpty(opt.BIN_DIR))
         self._path(APP_NAME, 'test_file1.txt')
 
     def test_path_wrong_file(self):
         print('++++++++++ test_path_wrong_file ++++++++++')
-        self._installOrUpdate(APP_NAME, os.path.join(PROJECT_DIR, 'resources/test_file1.txt'))
+        self._install(APP_NAME, self.RES.file1)
         self._remove(APP_NAME, pathOnly=True, desktopOnly=False)
-        opt.main(['--debug', '-y', 'path', APP_NAME, 'resources/test_file1.txt'])
+        opt.main([*DEBUG_ARGS, '-y', 'path', APP_NAME, 'resources/test_file1.txt'])
         self.assertTrue(self._isDirEmpty(opt.BIN_DIR))
 
+    def test_desktop_without_log_dir(self):
+        """The log file is opened first: nothing is copied without a log entry."""
+        print('++++++++++ test_desktop_without_log_dir ++++++++++')
+        self._install(APP_NAME, self.RES.file1)
+        shutil.rmtree(opt.INSTALL_DIR)
+        opt.main([*DEBUG_ARGS, '-y', 'desktop', APP_NAME, 'resources/test.desktop'])
+        self.assertTrue(self._isDirEmpty(opt.DESKTOP_DIR))
+        self.assertFalse(opt._logs)
+
+    def test_desktop_samefile(self):
+        print('++++++++++ test_desktop_samefile ++++++++++')
+        self._install(APP_NAME, self.RES.file1)
+        opt.main([*DEBUG_ARGS, '-y', 'desktop', APP_NAME, 'resources/test.desktop'])
+        desktopFile = f'{opt.DESKTOP_DIR}{os.sep}test.desktop'
+        with open(desktopFile, 'w') as f:
+            f.write('[Desktop Entry]')
+        # copying the installed file onto itself must not truncate it
+        opt.main([*DEBUG_ARGS, '-y', 'desktop', APP_NAME, desktopFile])
+        with open(desktopFile) as f:
+            self.assertEqual(f.read(), '[Desktop Entry]')
+
     def test_autocomplete(self):
         print('++++++++++ test_autocomplete ++++++++++')
-        self._installOrUpdate(APP_NAME, os.path.join(PROJECT_DIR, 'resources/test_file1.txt'))
-        opt.main(['--debug', 'autocomplete', APP_NAME, 'resources/test_file1.txt'])
-        expectedFile = os.path.join(opt.AUTOCOMPLETE_DIR, 'test_file1.txt')
+        self._install(APP_NAME, self.RES.file1)
+        opt.main([*DEBUG_ARGS, 'autocomplete', APP_NAME, 'resources/test_file1.txt'])
+        expectedFile = f'{opt.AUTOCOMPLETE_DIR}{os.sep}test_file1.txt'
         self.assertTrue(os.path.exists(expectedFile), msg=expectedFile)
 
+    def test_autocomplete_samefile(self):
+        print('++++++++++ test_autocomplete_samefile ++++++++++')
+        self._install(APP_NAME, self.RES.file1)
+        opt.main([*DEBUG_ARGS, 'autocomplete', APP_NAME, 'resources/test_file1.txt'])
+        scriptFile = f'{opt.AUTOCOMPLETE_DIR}{os.sep}test_file1.txt'
+        # single read/write and kernel copy
+        for content in (b'complete', b'x' * (fileutil.SMALL_FILE_SIZE + 1)):
+            with open(scriptFile, 'wb') as f:
+                f.write(content)
+            # copying the installed file onto itself must not truncate it
+            opt.main([*DEBUG_ARGS, '-y', 'autocomplete', APP_NAME, scriptFile])
+            with open(scriptFile, 'rb') as f:
+                self.assertEqual(f.read(), content)
+
     def test_alias(self):
         print('++++++++++ test_alias ++++++++++')
         APP_ALIAS = 'app-alias'
         APP_NAME_2 = 'app-v2'
-        self._installOrUpdate(APP_NAME, os.path.join(PROJECT_DIR, 'resources/test_file1.txt'))
-        self._installOrUpdate(APP_NAME_2, os.path.join(PROJECT_DIR, 'resources/test_file2.txt'))
+        self._install(APP_NAME, self.RES.file1)
+        self._install(APP_NAME_2, self.RES.file2)
         print('+++++ alias')
-        opt.main(['--debug', '-y', 'alias', APP_ALIAS, APP_NAME])
-        expectedFile = os.path.join(self._getInstallDir(APP_ALIAS), 'test_file1.txt')
+        opt.main([*DEBUG_ARGS, '-y', 'alias', APP_ALIAS, APP_NAME])
+        expectedFile = f'{self._getInstallDir(APP_ALIAS)}{os.sep}test_file1.txt'
         self.assertTrue(os.path.exists(expectedFile), msg=expectedFile)
         print('+++++ alias')
-        opt.main(['--debug', '-y', 'alias', APP_ALIAS, APP_NAME_2])
-        expectedFile = os.path.join(self._getInstallDir(APP_ALIAS), 'test_file2.txt')
+        opt.main([*DEBUG_ARGS, '-y', 'alias', APP_ALIAS, APP_NAME_2])
+        expectedFile = f'{self._getInstallDir(APP_ALIAS)}{os.sep}test_file2.txt'
         self.assertTrue(os.path.exists(expectedFile), msg=expectedFile)
         self._remove(APP_ALIAS)
         self._remove(APP_NAME)
@@ -237,35 +380,35 @@ class TestOpt(unittest.TestCase):
         """Update of alias app is not allowed."""
         print('++++++++++ test_alias_update ++++++++++')
         APP_ALIAS = 'app-alias'
-        self._installOrUpdate(APP_NAME, os.path.join(PROJECT_DIR, 'resources/test_file1.txt'))
+        self._install(APP_NAME, self.RES.file1)
         print('+++++ alias')
-        opt.main(['--debug', '-y', 'alias', APP_ALIAS, APP_NAME])
+        opt.main([*DEBUG_ARGS, '-y', 'alias', APP_ALIAS, APP_NAME])
         print('+++++ update')
-        opt.main(['--debug', '-y', 'update', APP_ALIAS, os.path.join(PROJECT_DIR, 'resources/test_file2.txt')])
-        self.assertTrue(os.path.islink(self._getInstallDir(APP_ALIAS)))
-        expectedFile = os.path.join(self._getInstallDir(APP_ALIAS), 'test_file1.txt')
+        opt.main([*DEBUG_ARGS, '-y', 'update', APP_ALIAS, self.RES.file2])
+        self._assertLink(self._getInstallDir(APP_ALIAS))
+        expectedFile = f'{self._getInstallDir(APP_ALIAS)}{os.sep}test_file1.txt'
         self.assertTrue(os.path.exists(expectedFile), msg=expectedFile)
     def test_alias_install(self):
         """Changing installed app to alias app is not allowed."""
         print('++++++++++ test_alias_install ++++++++++')
         APP_NAME_2 = 'app-v2'
-        self._installOrUpdate(APP_NAME, os.path.join(PROJECT_DIR, 'resources/test_file1.txt'))
-        self._installOrUpdate(APP_NAME_2, os.path.join(PROJECT_DIR, 'resources/test_file2.txt'))
+        self._install(APP_NAME, self.RES.file1)
+        self._install(APP_NAME_2, self.RES.file2)
         print('+++++ alias')
-        opt.main(['--debug', '-y', 'alias', APP_NAME_2, APP_NAME])
+        opt.main([*DEBUG_ARGS, '-y', 'alias', APP_NAME_2, APP_NAME])
         self.assertFalse(os.path.islink(self._getInstallDir(APP_NAME)))
         self.assertFalse(os.path.islink(self._getInstallDir(APP_NAME_2)))
-        expectedFile = os.path.join(self._getInstallDir(APP_NAME_2), 'test_file2.txt')
+        expectedFile = f'{self._getInstallDir(APP_NAME_2)}{os.sep}test_file2.txt'
         self.assertTrue(os.path.exists(expectedFile), msg=expectedFile)
     
     def test_remove(self):
         print('++++++++++ test_remove ++++++++++')
         executable = 'test_file1.txt'
-        self._installOrUpdate(APP_NAME, os.path.join(PROJECT_DIR, 'resources/test_file.tar'))
+        self._install(APP_NAME, self.RES.tarDir)
         self._path(APP_NAME, executable)
-        opt.main(['--debug', 'autocomplete', APP_NAME, 'resources/test_file1.txt'])
+        opt.main([*DEBUG_ARGS, 'autocomplete', APP_NAME, 'resources/test_file1.txt'])
         self._remove(APP_NAME)
-        self.assertFalse(os.path.exists(os.path.join(opt.BIN_DIR, executable)))
+        self.assertFalse(os.path.exists(f'{opt.BIN_DIR}{os.sep}{executable}'))
         self.assertTrue(self._isDirEmpty(opt.BIN_DIR))
         self.assertTrue(self._isDirEmpty(opt.INSTALL_DIR))
         self.assertTrue(self._isDirEmpty(opt.DESKTOP_DIR))
@@ -273,95 +416,191 @@ class TestOpt(unittest.TestCase):
         self.assertTrue(self._isDirEmpty(opt.ICON_DIR))
     def test_remove_brokenlink(self):
         print('++++++++++ test_remove_brokenlink ++++++++++')
-        execSrcFile = os.path.join(PROJECT_DIR, 'resources/test_file1.txt')
-        os.chmod(execSrcFile, 0o777) # rwx
-        self._installOrUpdate(APP_NAME, execSrcFile)
+        execSrcFile = self._fixture('rwx', 'test_file1.txt')
+        self._install(APP_NAME, execSrcFile)
         # symlink to test_file1.txt
-        executable = os.path.join(opt.BIN_DIR, 'test_file1.txt')
-        self.assertTrue(os.path.exists(executable))
+        executable = f'{opt.BIN_DIR}{os.sep}test_file1.txt'
+        self._assertLink(executable)
         # symlink is broken because file does not exist anymore
-        self._installOrUpdate(APP_NAME, os.path.join(PROJECT_DIR, 'resources/test_file2.txt'), ['test_file2.txt'], update=True)
+        self._update(APP_NAME, self.RES.file2, ['test_file2.txt'])
         self.assertFalse(os.path.exists(executable), msg=f'exists for broken link: {executable}')
         self.assertTrue(os.path.islink(executable), msg=f'islink: {executable}')
         self._remove(APP_NAME)
         self.assertFalse(os.path.exists(executable), msg=f'exists for broken link: {executable}')
         self.assertFalse(os.path.islink(executable), msg=f'islink not deleted: {executable}')
-        # reset permission
-        os.chmod(execSrcFile, 0o666) # rw
     
     def test_remove_unmanaged(self):
         print('++++++++++ test_remove_unmanaged ++++++++++')
         appDir = os.path.join(opt.OPT_DIR, APP_NAME)
-        os.makedirs(appDir, exist_ok=True)
-        opt.main(['--debug', '-y', 'remove', APP_NAME])
+        os.mkdir(appDir)
+        # refused when the task is created
+        self.assertRaises(opt.OptError, opt.RemoveTask, opt.Application.get(APP_NAME), False, False, False)
+        # the command refuses to remove
+        opt.main([*DEBUG_ARGS, '-y', 'remove', APP_NAME])
         self.assertFalse(os.path.exists(opt.INSTALL_DIR))
         self.assertTrue(os.path.exists(appDir))
     def test_remove_unmanaged_forced(self):
         print('++++++++++ test_remove_unmanaged_forced ++++++++++')
         appDir = os.path.join(opt.OPT_DIR, APP_NAME)
-        os.makedirs(appDir, exist_ok=True)
-        opt.main(['--debug', '-y', 'remove', '-f', APP_NAME])
+        os.mkdir(appDir)
+        opt.main([*DEBUG_ARGS, '-y', 'remove', '-f', APP_NAME])
         self.assertFalse(os.path.exists(opt.INSTALL_DIR))
         self.assertFalse(os.path.exists(appDir), appDir)
     
     def test_clean(self):
-        shutil.rmtree(ROOT_DIR)
+        # test root of older versions (tests use a temporary root now)
+        shutil.rmtree(ROOT_DIR, ignore_errors=True)
     
     # Helper methods
-    def _installOrUpdate(self, name, installFile, expectedFiles=[], skipFolder=None, update=False, updateDelete=True):
-        print(f'+++++ {"update" if update else "install"}')
-        cmd = ['-y', '--debug']
-        if update:
-            cmd.append('update') 
-            if updateDelete:
-                cmd.append('--delete') 
-        else:
-            cmd.append('install')
-        cmd.append(name)
-        cmd.append(installFile)
-        opt.main(cmd)
-        self.assertTrue(os.path.exists(self._getAppDir(name)))
-        self.assertTrue(os.path.islink(self._getAppDir(name)))
-        if skipFolder:
-            self.assertTrue(os.path.realpath(self._getAppDir(name)) == os.path.join(self._getInstallDir(name), skipFolder))
-        else:
-            self.assertTrue(os.path.realpath(self._getAppDir(name)) == self._getInstallDir(name))
-        self.assertTrue(os.path.exists(self._getInstallDir(name)))
-        for f in expectedFiles:
-            if skipFolder:
-                expectedFile = os.path.join(self._getInstallDir(name), skipFolder, f) 
-            else:
-                expectedFile = os.path.join(self._getInstallDir(name), f)
-            self.assertTrue(os.path.exists(expectedFile), msg=expectedFile)
+    def _install(self, name, installFile, expectedFiles=(), skipFolder=None):
+        print('+++++ install')
+        # in-process, no command line parsing
+        opt.runCommand(opt.CMD_INSTALL, debug=DEBUG, noPrompt=True, name=name, file=[installFile])
+        self._assertInstalled(name, expectedFiles, skipFolder)
+
+    def _update(self, name, installFile, expectedFiles=(), delete=True):
+        print('+++++ update')
+        opt.runCommand(opt.CMD_UPDATE, debug=DEBUG, noPrompt=True, name=name, file=[installFile], delete=delete)
+        self._assertInstalled(name, expectedFiles)
+
+    def _assertInstalled(self, name, expectedFiles, skipFolder=None):
+        self._assertLink(self._getAppDir(name))
+        installDir = self._getInstallDir(name)
+        # the application dir links to the (skipped) folder
+        contentDir = f'{installDir}{os.sep}{skipFolder}' if skipFolder else installDir
+        self.assertTrue(os.path.realpath(self._getAppDir(name)) == contentDir)
+        self.assertTrue(os.path.exists(installDir))
+        if expectedFiles:
+            # one directory scan instead of a stat per file (expected files are direct children)
+            with os.scandir(contentDir) as it:
+                present = {e.name for e in it}
+            missing = set(expectedFiles) - present
+            self.assertFalse(missing, msg=f'missing in {contentDir}: {sorted(missing)}')
     
+    def _resetApp(self, name):
+        """Delete the application dir and INSTALL_DIR without opt.py (reset between sub tests)."""
+        shutil.rmtree(opt.INSTALL_DIR, ignore_errors=True)
+        if os.path.lexists(self._getAppDir(name)):
+            os.unlink(self._getAppDir(name))
+
     def _path(self, name, executable):
         print('+++++ path')
-        opt.main(['--debug', '-y', 'path', name, os.path.join(self._getAppDir(APP_NAME), executable)])
-        self.assertTrue(os.path.islink(os.path.join(opt.BIN_DIR, executable)))
+        opt.runCommand(opt.CMD_PATH, debug=DEBUG, noPrompt=True, name=name, file=f'{self._getAppDir(APP_NAME)}{os.sep}{executable}')
+        self._assertLink(f'{opt.BIN_DIR}{os.sep}{executable}')
 
     def _remove(self, name, pathOnly=False, desktopOnly=False):
         print('+++++ remove')
-        cmd = ['-y', '--debug', 'remove']
-        if pathOnly:
-            cmd.append('--path-only')
-        if desktopOnly:
-            cmd.append('--desktop-only')
-        cmd.append(name)
-        opt.main(cmd)
+        opt.runCommand(opt.CMD_REMOVE, debug=DEBUG, noPrompt=True, name=name, pathOnly=pathOnly, desktopOnly=desktopOnly)
         if not pathOnly and not desktopOnly:
             self.assertFalse(os.path.exists(self._getAppDir(name)))
             self.assertFalse(os.path.exists(self._getInstallDir(name)))
     
+    def test_is_app_file(self):
+        print('++++++++++ test_is_app_file ++++++++++')
+        app = opt.Application(APP_NAME)
+        self.assertTrue(app.isAppFile(os.path.join(opt.OPT_DIR, APP_NAME, 'file.txt')))
+        self.assertTrue(app.isAppFile(os.path.join(opt.OPT_DIR, APP_NAME)))
+        self.assertFalse(app.isAppFile(os.path.join(opt.OPT_DIR, APP_NAME + 'x', 'file.txt')))
+        self.assertFalse(app.isAppFile(os.path.join(opt.OPT_DIR, APP_NAME, '..', 'other', 'file.txt')))
+
+    def test_atomic_symlink(self):
+        print('++++++++++ test_atomic_symlink ++++++++++')
+        linkDir = os.path.join(self.root, 'links')
+        os.mkdir(linkDir)
+        dst = os.path.join(linkDir, 'link')
+        fileutil.atomicSymlink(RES.file1, dst)
+        fileutil.atomicSymlink(RES.file2, dst)
+        self.assertEqual(os.readlink(dst), RES.file2)
+        # a regular file is not replaced
+        file = os.path.join(linkDir, 'file')
+        with open(file, 'w') as f:
+            f.write('content')
+        with self.assertRaises(FileExistsError):
+            fileutil.atomicSymlink(RES.file1, file)
+        with open(file) as f:
+            self.assertEqual(f.read(), 'content')
+        # no temporary link is left behind
+        self.assertEqual(sorted(os.listdir(linkDir)), ['file', 'link'])
+
+    def test_fast_parse(self):
+        print('++++++++++ test_fast_parse ++++++++++')
+        for argv in [['list'], ['--debug', 'list', APP_NAME], ['-y', '--yes', 'install', '--no-path', APP_NAME, 'a.tar', 'b.txt'],
+                     ['update', '--keep', 'a', '--keep=b', '--delete', APP_NAME, 'c.zip'], ['remove', '-f', '--path-only', APP_NAME],
+                     ['desktop', APP_NAME, 'a.desktop', 'a.png'], ['autocomplete', APP_NAME, 'a.sh'], ['path', '--link-name', 'x', APP_NAME, '-'],
+                     ['alias', 'app', APP_NAME]]:
+            args = opt._fastParse(argv)
+            self.assertIsNotNone(args, argv)
+            self.assertEqual(vars(opt._parseArgs(argv)), vars(args), argv)
+        # left to argparse
+        for argv in [[], ['-h'], ['--deb', 'list'], ['install', APP_NAME], ['install', APP_NAME, 'a', '--no-path', 'b'], ['alias', 'app'],
+                     ['list', 'a', 'b'], ['update', '--keep'], ['remove', '-fy', APP_NAME], ['instal', APP_NAME, 'a']]:
+            self.assertIsNone(opt._fastParse(argv), argv)
+
+    def test_run_command(self):
+        print('++++++++++ test_run_command ++++++++++')
+        self.assertRaises(TypeError, opt.runCommand, opt.CMD_INSTALL, name=APP_NAME)
+        self.assertRaises(TypeError, opt.runCommand, opt.CMD_LIST, unknown=True)
+        opt.runCommand(opt.CMD_LIST)
+
+    def _assertLink(self, path):
+        """Assert that path is a symlink to an existing file: one lstat and one stat."""
+        try:
+            isLink = stat.S_ISLNK(os.lstat(path).st_mode)
+        except FileNotFoundError:
+            self.fail(f'does not exist: {path}')
+        self.assertTrue(isLink, msg=f'no link: {path}')
+        try:
+            os.stat(path)
+        except FileNotFoundError:
+            self.fail(f'broken link: {path}')
+
     def _isDirEmpty(self, dir):
-        files = os.listdir(dir)
-        return len(files) == 0
+        # stop at the first entry
+        with os.scandir(dir) as it:
+            return next(it, None) is None
+
+    def _fixture(self, mode, name):
+        return os.path.join(self.fixtures, mode, name)
 
+    # opt's dirs are absolute and names have no separators: no need for os.path.join
     def _getAppDir(self, name):
-        return os.path.join(opt.OPT_DIR, name)
+        return f'{opt.OPT_DIR}{os.sep}{name}'
 
     def _getInstallDir(self, name):
-        return os.path.join(opt.INSTALL_DIR, name)
+        return f'{opt.INSTALL_DIR}{os.sep}{name}'
+
+def _runTests(names):
+    """Run the tests in this process: (testsRun, failures, errors, report of the failed tests)."""
+    stream = io.StringIO()
+    # buffer: test output is shown for failed tests only
+    result = unittest.TextTestRunner(stream=stream, buffer=True).run(unittest.TestSuite(TestOpt(n) for n in names))
+    problems = [('FAIL', f) for f in result.failures] + [('ERROR', e) for e in result.errors]
+    report = '\n'.join(f'{"=" * 70}\n{kind}: {test}\n{"-" * 70}\n{trace}' for kind, (test, trace) in problems)
+    return result.testsRun, len(result.failures), len(result.errors), report
+
+def _runParallel(jobs):
+    """Run all tests in jobs processes (each test has its own root, opt's globals are per process)."""
+    names = unittest.defaultTestLoader.getTestCaseNames(TestOpt)
+    groups = [names[i::jobs] for i in range(jobs)]
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        results = list(executor.map(_runTests, groups))
+    testsRun, failures, errors = (sum(r[i] for r in results) for i in range(3))
+    for r in results:
+        if r[3]:
+            print(r[3])
+    print(f'{"-" * 70}\nRan {testsRun} tests in {time.perf_counter() - start:.3f}s\n')
+    if failures or errors:
+        print(f'FAILED (failures={failures}, errors={errors})')
+        return False
+    print('OK')
+    return True
 
 if __name__ == '__main__':
-    unittest.main()
+    jobs = int(os.environ.get('OPT_TEST_JOBS', os.cpu_count() or 1))
+    if len(sys.argv) > 1 or jobs < 2:
+        # single tests and unittest options
+        unittest.main()
+    else:
+        sys.exit(0 if _runParallel(jobs) else 1)
     